@@ -1,2 +1,60 @@
 """Admin for the calendar_sync app."""
 from django.contrib import admin
+
+from .models import (CachedAssignment, FailedSyncRun, ProfiledSyncRun,
+                     SlowSyncRun, SyncRun, SyncSchedule)
+
+admin.site.register(CachedAssignment)
+
+
+@admin.register(SyncSchedule)
+class SyncScheduleAdmin(admin.ModelAdmin):
+    """Admin listing the sync schedules, hiding the users' Moodle sessions."""
+    list_display = ['user_id', 'next_sync_at', 'last_synced_at', 'last_active_at',
+                    'lease_owner', 'attempts']
+    search_fields = ['user_id']
+    ordering = ['next_sync_at']
+    # a live Moodle session logs in as the user, so it is neither shown nor editable
+    exclude = ['moodle_session_id']
+
+
+@admin.register(SyncRun)
+class SyncRunAdmin(admin.ModelAdmin):
+    """Admin listing all sync runs, newest first."""
+    list_display = [
+        'started_at', 'user_id', 'trigger', 'outcome', 'duration',
+        'login_duration', 'crawl_duration', 'parse_duration', 'list_duration', 'write_duration',
+        'moodle_requests', 'google_requests',
+        'events_created', 'events_updated', 'events_deleted',
+    ]
+    list_filter = ['outcome', 'trigger', 'started_at']
+    search_fields = ['user_id']
+    ordering = ['-started_at']
+    date_hierarchy = 'started_at'
+
+    def get_readonly_fields(self, request, obj=None):
+        return [field.name for field in self.model._meta.fields]
+
+
+@admin.register(SlowSyncRun)
+class SlowSyncRunAdmin(SyncRunAdmin):
+    """Admin listing the slowest sync runs first."""
+    ordering = ['-duration']
+
+
+@admin.register(FailedSyncRun)
+class FailedSyncRunAdmin(SyncRunAdmin):
+    """Admin listing only failed sync runs, newest first."""
+    list_display = ['started_at', 'user_id', 'trigger', 'duration', 'error']
+    list_filter = ['trigger', 'started_at']
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).filter(outcome=SyncRun.FAILURE)
+
+
+@admin.register(ProfiledSyncRun)
+class ProfiledSyncRunAdmin(SyncRunAdmin):
+    """Admin listing only profiled sync runs, newest first."""
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).filter(profile__isnull=False)
@@ -0,0 +1,86 @@
+"""
+Per-user single-flight coalescing and debounce of sync triggers.
+
+Only one sync per key runs in the process at a time: triggers arriving while it runs wait
+for it and share its result (or exception) instead of crawling again, and triggers arriving
+within `DEBOUNCE_WINDOW` after it finished get the same result right away. Full syncs are
+keyed by user and targeted syncs by user and targets, so a full and a targeted sync of the
+same user can run in the process at once.
+Syncs in other processes are kept apart by the lease on the user's `SyncSchedule`, see
+`calendar_sync.jobs.claim_user`.
+"""
+from __future__ import annotations
+
+import datetime
+import threading
+import time
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    from collections.abc import Callable, Hashable
+
+DEBOUNCE_WINDOW = datetime.timedelta(seconds=30)
+
+
+class Flight:
+    """A sync in progress that other triggers can wait for."""
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: dict[str, Any] | None = None
+        self.error: BaseException | None = None
+
+    def wait(self) -> dict[str, Any]:
+        """Wait for the sync and return its result, re-raising its exception."""
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+_lock = threading.Lock()
+_flights: dict[Hashable, Flight] = {}
+# key -> (monotonic time when the sync finished, result)
+_recent: dict[Hashable, tuple[float, dict[str, Any]]] = {}
+
+
+def coalesce(key: Hashable, run: Callable[[], dict[str, Any]],
+             debounce: bool = True) -> dict[str, Any]:
+    """
+    Run the sync `run` unless one with the same key, e.g. the user ID, is in flight or, if
+    `debounce` is set, has just finished, in which case its result is returned instead.
+    """
+    now = time.monotonic()
+    with _lock:
+        recent = _recent.get(key)
+        if (debounce and recent is not None
+                and now - recent[0] < DEBOUNCE_WINDOW.total_seconds()):
+            return recent[1]
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = Flight()
+    if not leader:
+        return flight.wait()
+
+    try:
+        flight.result = run()
+        return flight.result
+    except BaseException as e:
+        flight.error = e
+        raise
+    finally:
+        with _lock:
+            del _flights[key]
+            if flight.error is None:
+                forget_expired(time.monotonic())
+                _recent[key] = (time.monotonic(), flight.result)
+        flight.done.set()
+
+
+def forget_expired(now: float) -> None:
+    """Drop the results older than the debounce window. Must be called with the lock held."""
+    expired = [key for key, (finished_at, _) in _recent.items()
+               if now - finished_at >= DEBOUNCE_WINDOW.total_seconds()]
+    for key in expired:
+        del _recent[key]
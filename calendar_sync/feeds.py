@@ -0,0 +1,188 @@
+"""
+Read-only iCalendar feeds rendered from the most recently crawled assignments.
+
+Each assignment's VEVENT is rendered once when it changes and stored with it, so serving a
+feed only concatenates stored text, and clients polling an unchanged feed are answered
+with 304 from a single aggregate query.
+"""
+from __future__ import annotations
+
+import datetime
+import hashlib
+import html
+import re
+from typing import TYPE_CHECKING
+
+from django.core import signing
+from django.db.models import Count, Max
+from django.utils import timezone
+
+from .models import CachedAssignment
+from .sync.records import Assignment
+from .sync.utils import get_color_id, parse_deadline
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable
+
+SIGNING_SALT = 'calendar_sync.feeds'
+
+# CSS color names (RFC 7986) of the color IDs returned by `get_color_id`
+COLOR_NAMES = {
+    2: 'green',
+    8: 'gray',
+    11: 'red',
+}
+
+CALENDAR_HEADER = [
+    'BEGIN:VCALENDAR',
+    'VERSION:2.0',
+    'PRODID:-//Moodle Calendar//Moodle Deadline//EN',
+    'CALSCALE:GREGORIAN',
+    'X-WR-CALNAME:Moodle Deadline',
+    'X-WR-TIMEZONE:Asia/Taipei',
+    'REFRESH-INTERVAL;VALUE=DURATION:PT1H',
+]
+CALENDAR_FOOTER = ['END:VCALENDAR']
+
+
+def make_feed_token(user_id: int) -> str:
+    """Make the token identifying the feed of the user in its URL."""
+    return signing.Signer(salt=SIGNING_SALT).sign(str(user_id))
+
+
+def get_user_id(token: str) -> int | None:
+    """Get the user id from a feed token, None if the token is invalid."""
+    try:
+        return int(signing.Signer(salt=SIGNING_SALT).unsign(token))
+    except (signing.BadSignature, ValueError):
+        return None
+
+
+def escape_text(text: str) -> str:
+    """Escape a TEXT value as specified in RFC 5545."""
+    return (text.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+            .replace('\r\n', '\\n').replace('\n', '\\n'))
+
+
+def fold_line(line: str) -> str:
+    """Fold a content line into lines of at most 75 octets."""
+    encoded = line.encode('utf-8')
+    if len(encoded) <= 75:
+        return line
+
+    lines = []
+    start = 0
+    limit = 75
+    while start < len(encoded):
+        end = min(start + limit, len(encoded))
+        # never split a multi-byte character
+        while end < len(encoded) and encoded[end] & 0xC0 == 0x80:
+            end -= 1
+        lines.append(encoded[start:end].decode('utf-8'))
+        start = end
+        # continuation lines start with a space
+        limit = 74
+    return '\r\n '.join(lines)
+
+
+def html_to_text(description: str) -> str:
+    """Convert an HTML description to plain text."""
+    text = re.sub(r'<br\s*/?>|</p>|</div>|</li>', '\n', description)
+    text = html.unescape(re.sub(r'<[^>]+>', '', text))
+    return '\n'.join(line.strip() for line in text.splitlines() if line.strip())
+
+
+def format_utc(date: datetime.datetime) -> str:
+    """Format a datetime as a UTC DATE-TIME value."""
+    return date.astimezone(datetime.timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def render_vevent(assign: Assignment, stamp: datetime.datetime) -> str:
+    """Render the VEVENT of an assignment."""
+    deadline = format_utc(parse_deadline(assign.deadline))
+    color_id = get_color_id(assign)
+    uid = hashlib.sha1(assign.url.encode('utf-8')).hexdigest()
+    lines = [
+        'BEGIN:VEVENT',
+        f'UID:{uid}@moodle-calendar',
+        f'DTSTAMP:{format_utc(stamp)}',
+        f'DTSTART:{deadline}',
+        f'DTEND:{deadline}',
+        f'SUMMARY:{escape_text(assign.title)}',
+        f'DESCRIPTION:{escape_text(html_to_text(assign.description))}',
+        f'URL:{assign.url}',
+        f'COLOR:{COLOR_NAMES[color_id]}',
+        f'CATEGORIES:{escape_text(assign.submission_status or "unknown")}',
+        'END:VEVENT',
+    ]
+    return '\r\n'.join(fold_line(line) for line in lines)
+
+
+def is_cached(row: CachedAssignment, assign: Assignment) -> bool:
+    """Check if the cached row is identical to the assignment."""
+    return (row.title == assign.title
+            and row.deadline == assign.deadline
+            and row.description == assign.description
+            and row.can_submit == assign.can_submit
+            and row.submission_status == assign.submission_status)
+
+
+def store_assignments(user_id: int, assignments: Iterable[Assignment],
+                      prune: bool = True) -> None:
+    """
+    Store the crawled assignments of the user, rendering only the changed ones.
+    If `prune` is set, cached assignments that were not crawled are removed.
+    """
+    now = timezone.now()
+    cached = {row.url: row for row in CachedAssignment.objects.filter(user_id=user_id)}
+    for assign in assignments:
+        row = cached.pop(assign.url, None)
+        fetched_at = (datetime.datetime.fromtimestamp(assign.fetched_at, datetime.timezone.utc)
+                      if assign.fetched_at else None)
+        if row is not None and is_cached(row, assign):
+            if row.fingerprint != assign.fingerprint or row.fetched_at != fetched_at:
+                # keep `updated_at` and thus the feed ETag unchanged
+                CachedAssignment.objects.filter(pk=row.pk).update(
+                    fingerprint=assign.fingerprint, fetched_at=fetched_at)
+            continue
+        if row is None:
+            row = CachedAssignment(user_id=user_id, url=assign.url)
+        row.title = assign.title
+        row.deadline = assign.deadline
+        row.description = assign.description
+        row.can_submit = assign.can_submit
+        row.submission_status = assign.submission_status or ''
+        row.fingerprint = assign.fingerprint
+        row.fetched_at = fetched_at
+        row.vevent = render_vevent(assign, now)
+        row.save()
+
+    if prune and cached:
+        CachedAssignment.objects.filter(pk__in=[row.pk for row in cached.values()]).delete()
+
+
+def load_assignments(user_id: int) -> dict[str, Assignment]:
+    """Load the cached assignments of the user keyed by URL, see `store_assignments`."""
+    return {
+        row.url: Assignment(
+            title=row.title, deadline=row.deadline, description=row.description,
+            can_submit=row.can_submit, submission_status=row.submission_status, url=row.url,
+            fingerprint=row.fingerprint,
+            fetched_at=row.fetched_at.timestamp() if row.fetched_at else 0.0)
+        for row in CachedAssignment.objects.filter(user_id=user_id)
+    }
+
+
+def get_feed_etag(user_id: int) -> str:
+    """Get the ETag of the user's feed without rendering it."""
+    stats = CachedAssignment.objects.filter(user_id=user_id).aggregate(
+        count=Count('pk'), updated_at=Max('updated_at'))
+    updated_at = stats['updated_at'].timestamp() if stats['updated_at'] else 0
+    return f'{stats["count"]}-{updated_at}'
+
+
+def render_feed(user_id: int) -> str:
+    """Render the user's feed from the stored VEVENTs."""
+    vevents = CachedAssignment.objects.filter(user_id=user_id).order_by(
+        'pk').values_list('vevent', flat=True)
+    return '\r\n'.join([*CALENDAR_HEADER, *vevents, *CALENDAR_FOOTER]) + '\r\n'
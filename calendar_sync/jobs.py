@@ -0,0 +1,187 @@
+"""
+Lease-based queue of sync jobs backed by `SyncSchedule`.
+
+A due schedule is a job. Workers claim jobs with a conditional update that only succeeds
+when nobody holds an unexpired lease on the user, so any number of worker processes on
+any number of machines can poll the same table without syncing a user twice at the same
+time. A worker keeps its lease alive with heartbeats; if it dies, the lease expires after
+`VISIBILITY_TIMEOUT` and the job becomes visible to other workers again.
+"""
+from __future__ import annotations
+
+import datetime
+import logging
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+from typing import TYPE_CHECKING
+
+from django.db import connections
+from django.db.models import Q
+from django.db.models.functions import Mod
+from django.utils import timezone
+
+from . import scheduling
+from .models import SyncSchedule
+from .sync.exceptions import CircuitOpenException
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+logger = logging.getLogger(__name__)
+
+VISIBILITY_TIMEOUT = datetime.timedelta(minutes=5)
+HEARTBEAT_INTERVAL = datetime.timedelta(minutes=1)
+MAX_RETRY_INTERVAL = datetime.timedelta(hours=12)
+# how often a trigger checks whether another process has finished syncing the user
+RELEASE_POLL_INTERVAL = datetime.timedelta(seconds=1)
+# spreads out the users deferred by an open circuit so they don't all retry at once
+CIRCUIT_DEFER_JITTER = datetime.timedelta(minutes=5)
+
+
+def make_worker_id() -> str:
+    """Make an id that is unique among all workers on all machines."""
+    return f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+
+def lease_available(now: datetime.datetime) -> Q:
+    """Condition for schedules that are not leased by any worker."""
+    return Q(lease_expires_at__isnull=True) | Q(lease_expires_at__lt=now)
+
+
+def claim(worker_id: str, limit: int, shard: int = 0, num_of_shards: int = 1,
+          ) -> list[SyncSchedule]:
+    """
+    Claim up to `limit` due jobs of the given shard, most overdue first.
+    Users are assigned to shards by `user_id % num_of_shards`.
+    """
+    now = timezone.now()
+    candidates = scheduling.due_schedules().filter(lease_available(now))
+    if num_of_shards > 1:
+        candidates = candidates.annotate(
+            shard=Mod('user_id', num_of_shards)).filter(shard=shard)
+
+    claimed = []
+    # look at more candidates than needed since other workers may win some of them
+    for pk in candidates.values_list('pk', flat=True)[:limit * 2]:
+        won = SyncSchedule.objects.filter(pk=pk).filter(lease_available(now)).update(
+            lease_owner=worker_id, lease_expires_at=now + VISIBILITY_TIMEOUT, heartbeat_at=now)
+        if won:
+            claimed.append(SyncSchedule.objects.get(pk=pk))
+            if len(claimed) == limit:
+                break
+    return claimed
+
+
+def claim_user(user_id: int, worker_id: str) -> SyncSchedule | None:
+    """
+    Claim the job of the given user whether it is due or not, e.g. for a manual sync.
+    Returns None if another worker holds the lease.
+    """
+    now = timezone.now()
+    SyncSchedule.objects.get_or_create(user_id=user_id, defaults={'next_sync_at': now})
+    won = SyncSchedule.objects.filter(user_id=user_id).filter(lease_available(now)).update(
+        lease_owner=worker_id, lease_expires_at=now + VISIBILITY_TIMEOUT, heartbeat_at=now)
+    return SyncSchedule.objects.get(user_id=user_id) if won else None
+
+
+def wait_for_release(user_id: int, timeout: datetime.timedelta = VISIBILITY_TIMEOUT) -> bool:
+    """Wait until nobody holds the lease on the user, returns False on timeout."""
+    deadline = time.monotonic() + timeout.total_seconds()
+    while True:
+        if SyncSchedule.objects.filter(user_id=user_id).filter(
+                lease_available(timezone.now())).exists():
+            return True
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(RELEASE_POLL_INTERVAL.total_seconds())
+
+
+def wait_and_claim_user(user_id: int, worker_id: str,
+                        timeout: datetime.timedelta = VISIBILITY_TIMEOUT) -> SyncSchedule:
+    """
+    Claim the job of the given user like `claim_user`, waiting while another worker holds
+    the lease. Raises `TimeoutError` if the lease is not won within `timeout`.
+    """
+    deadline = time.monotonic() + timeout.total_seconds()
+    while True:
+        schedule = claim_user(user_id, worker_id)
+        if schedule is not None:
+            return schedule
+        if time.monotonic() >= deadline:
+            raise TimeoutError(f'Timed out waiting for the lease on user {user_id}.')
+        time.sleep(RELEASE_POLL_INTERVAL.total_seconds())
+
+
+def heartbeat(schedule: SyncSchedule, worker_id: str) -> bool:
+    """Extend the lease on the job, returns False if the lease has been lost."""
+    now = timezone.now()
+    return bool(SyncSchedule.objects.filter(pk=schedule.pk, lease_owner=worker_id).update(
+        lease_expires_at=now + VISIBILITY_TIMEOUT, heartbeat_at=now))
+
+
+def release(schedule: SyncSchedule, worker_id: str) -> None:
+    """Give up the lease on the job."""
+    SyncSchedule.objects.filter(pk=schedule.pk, lease_owner=worker_id).update(
+        lease_owner='', lease_expires_at=None)
+
+
+class Heartbeat:
+    """Context manager sending heartbeats for a job from a background thread."""
+
+    def __init__(self, schedule: SyncSchedule, worker_id: str) -> None:
+        self.schedule = schedule
+        self.worker_id = worker_id
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self) -> None:
+        """Send heartbeats until stopped."""
+        try:
+            while not self.stopped.wait(HEARTBEAT_INTERVAL.total_seconds()):
+                if not heartbeat(self.schedule, self.worker_id):
+                    logger.warning('Lost the lease on user %d.', self.schedule.user_id)
+                    return
+        finally:
+            connections.close_all()
+
+    def __enter__(self) -> Heartbeat:
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.stopped.set()
+        self.thread.join()
+
+
+def run_job(schedule: SyncSchedule, worker_id: str,
+            sync_user: Callable[[int, str], object]) -> bool:
+    """
+    Run a claimed job with `sync_user(user_id, session_id)` and release it.
+    Failed jobs are retried with exponential backoff. Returns whether the sync succeeded.
+    """
+    try:
+        with Heartbeat(schedule, worker_id):
+            sync_user(schedule.user_id, schedule.moodle_session_id)
+    except CircuitOpenException as e:
+        # the service is down, not the user's sync, so don't count it as an attempt
+        logger.info('Deferring sync of user %d: %s', schedule.user_id, e)
+        scheduling.defer(schedule, datetime.timedelta(seconds=e.retry_after)
+                         + random.random() * CIRCUIT_DEFER_JITTER)
+        return False
+    except Exception:  # pylint: disable=broad-except
+        logger.exception('Sync of user %d failed.', schedule.user_id)
+        schedule.attempts += 1
+        schedule.save(update_fields=['attempts'])
+        scheduling.defer(schedule, min(
+            scheduling.RETRY_INTERVAL * 2 ** (schedule.attempts - 1), MAX_RETRY_INTERVAL))
+        return False
+    else:
+        if schedule.attempts:
+            SyncSchedule.objects.filter(pk=schedule.pk).update(attempts=0)
+        return True
+    finally:
+        release(schedule, worker_id)
@@ -0,0 +1 @@
+"""Load-testing harness with local stand-ins for Moodle and Google Calendar."""
@@ -0,0 +1,167 @@
+"""
+Fake Google Calendar API v3 implementing the calls made by `GoogleCalendar`.
+
+Users are told apart by their bearer token. Quotas are enforced like the real API: a
+per-user limit of requests per minute answered with 403 `userRateLimitExceeded` and a
+global limit of requests per second answered with 429 `rateLimitExceeded`. Listed events
+are filtered by `timeMin` and `timeMax` like the real API, so syncs matching events outside
+their listing window create duplicates here too.
+"""
+from __future__ import annotations
+
+import collections
+import datetime
+import itertools
+import json
+import random
+import re
+import time
+import zoneinfo
+from urllib.parse import parse_qs, urlparse
+
+from .server import FakeRequestHandler, FakeServer
+
+CALENDARS_PATH = re.compile(r'^/calendar/v3/calendars/?$')
+EVENTS_PATH = re.compile(r'^/calendar/v3/calendars/(?P<cal>[^/]+)/events(?:/(?P<event>[^/]+))?$')
+
+
+class FakeGoogleCalendar(FakeServer):
+    """Fake Google Calendar API keeping calendars and events in memory."""
+
+    def __init__(self, user_quota_per_minute: int = 600, quota_per_second: int = 500,
+                 latency: float = 0.0) -> None:
+        super().__init__(GoogleCalendarHandler)
+        self.user_quota_per_minute = user_quota_per_minute
+        self.quota_per_second = quota_per_second
+        self.latency = latency
+        self.ids = itertools.count(1)
+        # token -> calendar id -> {'summary': ..., 'events': {event id: event}}
+        self.calendars = collections.defaultdict(dict)
+        self.user_requests = collections.defaultdict(collections.deque)
+        self.requests = collections.deque()
+
+    @property
+    def api_endpoint(self) -> str:
+        """Endpoint to pass as `google_api_endpoint`."""
+        return f'{self.url}/calendar/v3/'
+
+    def within_quota(self, token: str) -> int | None:
+        """Record a request, returns the error status if it exceeds a quota."""
+        now = time.monotonic()
+        with self.lock:
+            for window, requests in ((1, self.requests), (60, self.user_requests[token])):
+                while requests and requests[0] <= now - window:
+                    requests.popleft()
+            if len(self.requests) >= self.quota_per_second:
+                return 429
+            if len(self.user_requests[token]) >= self.user_quota_per_minute:
+                return 403
+            self.requests.append(now)
+            self.user_requests[token].append(now)
+        return None
+
+
+class GoogleCalendarHandler(FakeRequestHandler):
+    """Request handler of `FakeGoogleCalendar`."""
+
+    def send_json(self, status: int, body: dict) -> None:
+        """Send a JSON response."""
+        content = json.dumps(body).encode() if status != 204 else b''
+        self.send(status, content, content_type='application/json')
+
+    def send_error_json(self, status: int, reason: str) -> None:
+        """Send an error in the format of Google APIs."""
+        self.send_json(status, {'error': {
+            'code': status, 'message': reason, 'errors': [{'reason': reason}]}})
+
+    def handle_api(self):
+        """Check authorization and quotas, then dispatch the call."""
+        fake = self.server.fake
+        auth = self.headers.get('Authorization', '')
+        if not auth.startswith('Bearer '):
+            self.send_error_json(401, 'authError')
+            return
+        token = auth.removeprefix('Bearer ')
+        quota_status = fake.within_quota(token)
+        if quota_status == 429:
+            self.send_error_json(429, 'rateLimitExceeded')
+            return
+        if quota_status == 403:
+            self.send_error_json(403, 'userRateLimitExceeded')
+            return
+        if fake.latency:
+            time.sleep(random.uniform(0.5, 1.5) * fake.latency)
+
+        body = json.loads(self.read_body() or b'{}')
+        url = urlparse(self.path)
+        query = {name: values[0] for name, values in parse_qs(url.query).items()}
+        with fake.lock:
+            response = self.dispatch(fake.calendars[token], url.path, query, body)
+        if response is None:
+            self.send_error_json(404, 'notFound')
+        else:
+            self.send_json(*response)
+
+    def dispatch(self, calendars: dict, path: str, query: dict[str, str],
+                 body: dict) -> tuple[int, dict] | None:
+        """Run the call on the calendars of the user, None if not found."""
+        fake = self.server.fake
+        if path == '/calendar/v3/users/me/calendarList' and self.command == 'GET':
+            return 200, {'items': [{'id': cal_id, 'summary': cal['summary']}
+                                   for cal_id, cal in calendars.items()]}
+        if path == '/calendar/v3/colors' and self.command == 'GET':
+            return 200, {'event': {str(i): {} for i in range(1, 12)}}
+        if CALENDARS_PATH.match(path) and self.command == 'POST':
+            cal_id = f'cal{next(fake.ids)}'
+            calendars[cal_id] = {'summary': body.get('summary'), 'events': {}}
+            return 200, {'id': cal_id, **body}
+
+        match = EVENTS_PATH.match(path)
+        if not match or match['cal'] not in calendars:
+            return None
+        events = calendars[match['cal']]['events']
+        event_id = match['event']
+        if event_id is None and self.command == 'GET':
+            return 200, {'items': [event for event in events.values()
+                                   if in_window(event, query.get('timeMin'),
+                                                query.get('timeMax'))]}
+        if event_id is None and self.command == 'POST':
+            event_id = f'evt{next(fake.ids)}'
+            events[event_id] = {**body, 'id': event_id, 'htmlLink': f'{fake.url}/{event_id}'}
+            return 200, events[event_id]
+        if event_id not in events:
+            return None
+        if self.command == 'PUT':
+            events[event_id] = {**body, 'id': event_id, 'htmlLink': f'{fake.url}/{event_id}'}
+            return 200, events[event_id]
+        if self.command == 'DELETE':
+            del events[event_id]
+            return 204, {}
+        return None
+
+    do_GET = do_POST = do_PUT = do_DELETE = handle_api
+
+
+def event_time(when: dict) -> datetime.datetime:
+    """Time of the start or end of an event, in the time zone of the event if it has none."""
+    try:
+        value = datetime.datetime.fromisoformat(when['dateTime'])
+    except ValueError:
+        # deadlines from `parse_date` are not zero-padded, which the real API accepts
+        value = datetime.datetime.strptime(when['dateTime'], '%Y-%m-%dT%H:%M:%S')
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=zoneinfo.ZoneInfo(when.get('timeZone') or 'UTC'))
+    return value
+
+
+def in_window(event: dict, time_min: str | None, time_max: str | None) -> bool:
+    """
+    Check if the event is listed by `events.list` with the given `timeMin` and `timeMax`,
+    i.e. it ends after `time_min` and starts before `time_max`.
+    """
+    start, end = event_time(event['start']), event_time(event['end'])
+    if time_min is not None and end <= datetime.datetime.fromisoformat(time_min):
+        return False
+    if time_max is not None and start >= datetime.datetime.fromisoformat(time_max):
+        return False
+    return True
@@ -0,0 +1,142 @@
+"""
+Fake NCKU Moodle site serving generated month views and assignment pages.
+
+Sessions are named `session-<user id>`, both for sessions created by the login form and
+for session ids passed to the sync endpoint, so every synthetic user sees their own
+submission statuses.
+"""
+from __future__ import annotations
+
+import datetime
+import http.cookies
+import random
+import time
+import zlib
+from urllib.parse import parse_qs, urlparse
+
+from .server import FakeRequestHandler, FakeServer
+
+TAIPEI = datetime.timezone(datetime.timedelta(hours=8))
+
+
+class FakeMoodle(FakeServer):
+    """
+    Fake Moodle with `assignments_per_month` assignments in every month.
+
+    Each page is delayed by `latency` seconds on average, fails with 503 with probability
+    `error_rate`, and the submission status of an assignment flips with probability
+    `change_rate` to exercise event updates.
+    """
+
+    def __init__(self, assignments_per_month: int = 5, latency: float = 0.0,
+                 error_rate: float = 0.0, change_rate: float = 0.0) -> None:
+        super().__init__(MoodleHandler)
+        self.assignments_per_month = assignments_per_month
+        self.latency = latency
+        self.error_rate = error_rate
+        self.change_rate = change_rate
+
+
+class MoodleHandler(FakeRequestHandler):
+    """Request handler of `FakeMoodle`."""
+
+    @property
+    def user_id(self) -> str | None:
+        """Get the user id from the session cookie, None if not logged in."""
+        cookie = http.cookies.SimpleCookie(self.headers.get('Cookie', ''))
+        if 'MoodleSession' not in cookie:
+            return None
+        return cookie['MoodleSession'].value.removeprefix('session-')
+
+    def simulate_conditions(self) -> bool:
+        """Apply latency and errors, returns whether the request has been answered."""
+        fake = self.server.fake
+        if fake.latency:
+            time.sleep(random.uniform(0.5, 1.5) * fake.latency)
+        if random.random() < fake.error_rate:
+            self.send(503, b'Service Unavailable')
+            return True
+        return False
+
+    def do_HEAD(self):  # pylint: disable=invalid-name
+        """Answer the session probe."""
+        self.do_GET()
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Serve the home, month view and assignment pages."""
+        if self.simulate_conditions():
+            return
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if url.path == '/':
+            self.send(200, self.home_page().encode())
+        elif url.path == '/my/':
+            if self.user_id is None:
+                self.send(303, headers={'Location': '/login/index.php'})
+            else:
+                self.send(200, b'<html></html>')
+        elif url.path == '/calendar/view.php':
+            self.send(200, self.month_page(int(query['time'][0])).encode())
+        elif url.path == '/mod/assign/view.php':
+            self.send(200, self.assign_page(query['id'][0]).encode())
+        else:
+            self.send(404, b'Not Found')
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """Accept any credentials on the login form."""
+        if self.simulate_conditions():
+            return
+        form = parse_qs(self.read_body().decode())
+        if urlparse(self.path).path != '/login/index.php' or 'username' not in form:
+            self.send(400, b'Bad Request')
+            return
+        self.send(303, headers={
+            'Location': '/',
+            'Set-Cookie': f'MoodleSession=session-{form["username"][0]}; Path=/',
+        })
+
+    def home_page(self) -> str:
+        """Render the home page, with the login form if not logged in."""
+        if self.user_id is None:
+            return '<html><body><input name="logintoken" value="fake-token"></body></html>'
+        return (
+            '<html><head><script>M.cfg = {"sesskey":"fake-sesskey"};</script></head><body>'
+            f'<div class="popover-region-notifications" data-userid="{self.user_id}"></div>'
+            '</body></html>'
+        )
+
+    def month_page(self, timestamp: int) -> str:
+        """Render the month view containing `timestamp`."""
+        month = datetime.datetime.fromtimestamp(timestamp, TAIPEI)
+        base_url = self.server.fake.url
+        days = []
+        for i in range(self.server.fake.assignments_per_month):
+            event_id = f'{month.year}{month.month:02}{i:03}'
+            day = datetime.datetime(month.year, month.month, i % 28 + 1, tzinfo=TAIPEI)
+            days.append(
+                f'<td data-day-timestamp="{int(day.timestamp())}"><ul>'
+                f'<li data-region="event-item" data-event-id="{event_id}" '
+                f'data-event-title="Assignment {event_id}"><span>23:59</span> '
+                f'<a data-action="view-event" data-event-id="{event_id}" '
+                f'href="{base_url}/mod/assign/view.php?id={event_id}">Assignment {event_id}</a>'
+                '</li></ul></td>'
+            )
+        return f'<html><body><table><tr>{"".join(days)}</tr></table></body></html>'
+
+    def assign_page(self, assign_id: str) -> str:
+        """Render the page of the assignment with the given id."""
+        year, month, index = int(assign_id[:4]), int(assign_id[4:6]), int(assign_id[6:])
+        submitted = zlib.crc32(f'{self.user_id}-{assign_id}'.encode()) % 2 == 0
+        if random.random() < self.server.fake.change_rate:
+            submitted = not submitted
+        status = '已繳交作業' if submitted else '沒有繳交作業'
+        return (
+            '<html><body><div role="main">'
+            f'<h2>Assignment {assign_id}</h2>'
+            f'<div id="intro"><p>Description of assignment {assign_id}.</p></div>'
+            '<table>'
+            f'<tr><th>繳交狀態</th><td>{status}</td></tr>'
+            '<tr><th>規定繳交時間</th>'
+            f'<td>{year}年 {month}月 {index % 28 + 1}日(星期一) 23:59</td></tr>'
+            '</table></div></body></html>'
+        )
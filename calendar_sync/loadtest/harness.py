@@ -0,0 +1,193 @@
+"""
+Drives the sync endpoint and the background scheduler with a synthetic user population.
+
+Syncs are pointed at `FakeMoodle` and `FakeGoogleCalendar` through the `moodle_url` and
+`google_api_endpoint` config keys, so no request leaves the machine.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import os
+import resource
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+import yaml
+from django.core.files.base import ContentFile
+from django.db import connections
+from django.db.models import Avg, Count, Sum
+from django.test import Client
+from django.utils import timezone
+
+from oauth.models import UserOAuth
+
+from .. import scheduling, views
+from ..models import SyncRun, SyncSchedule
+
+logger = logging.getLogger(__name__)
+
+SYNC_PATH = '/mc/api/calendar_sync/sync/'
+
+
+def write_sync_config(path: str, moodle_url: str, google_api_endpoint: str,
+                      num_of_months: int, **options: Any) -> None:
+    """Write the sync config pointing at the fake servers, with any other config options."""
+    config = {
+        'moodle_url': moodle_url,
+        'google_api_endpoint': google_api_endpoint,
+        'num_of_months': num_of_months,
+        **options,
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        yaml.safe_dump(config, f)
+
+
+def create_users(num_of_users: int) -> list[int]:
+    """Create synthetic users bound to fake Google tokens, returns their Moodle ids."""
+    user_ids = list(range(1, num_of_users + 1))
+    for user_id in user_ids:
+        token = {
+            'token': f'loadtest-{user_id}',
+            'refresh_token': 'loadtest',
+            'client_id': 'loadtest',
+            'client_secret': 'loadtest',
+            # never refreshed against the real token endpoint
+            'expiry': '2999-01-01T00:00:00Z',
+        }
+        obj = UserOAuth(user_id=user_id, email=f'user{user_id}@loadtest.invalid')
+        obj.oauth_credentials.save(f'user_{user_id}.json', ContentFile(json.dumps(token)))
+    return user_ids
+
+
+def percentile(values: list[float], percent: float) -> float:
+    """Get the `percent`-th percentile of `values`."""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, round(percent / 100 * (len(values) - 1)))
+    return values[index]
+
+
+def run_endpoint_load(user_ids: list[int], concurrency: int) -> dict[str, Any]:
+    """POST the sync endpoint once for every user from `concurrency` threads."""
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+
+    def post_sync(user_id: int) -> None:
+        client = Client()
+        start = time.perf_counter()
+        try:
+            status = client.post(SYNC_PATH, headers={
+                'Moodle-Session': f'session-{user_id}',
+                'Moodle-ID': str(user_id),
+            }).status_code
+        except Exception:  # pylint: disable=broad-except
+            logger.exception('Sync of user %d raised.', user_id)
+            status = 'exception'
+        finally:
+            connections.close_all()
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(post_sync, user_ids))
+    return summarize('endpoint', time.perf_counter() - start, latencies, statuses)
+
+
+def run_scheduler_load() -> dict[str, Any]:
+    """Mark every schedule as due and run `background_sync` until none is left."""
+    started_at = timezone.now()
+    SyncSchedule.objects.update(next_sync_at=started_at)
+    total = scheduling.due_schedules().count()
+    latencies = []
+
+    start = time.perf_counter()
+    remaining = total
+    while remaining:
+        batch_start = time.perf_counter()
+        views.background_sync.now()
+        latencies.append(time.perf_counter() - batch_start)
+        left = scheduling.due_schedules().count()
+        if left == remaining:
+            # nothing was claimed, e.g. because a circuit breaker is open
+            break
+        remaining = left
+    elapsed = time.perf_counter() - start
+
+    synced = SyncSchedule.objects.filter(last_synced_at__gte=started_at).count()
+    statuses = {'synced': synced, 'failed': total - synced}
+    return summarize('scheduler batches', elapsed, latencies, statuses, completed=synced)
+
+
+def summarize(name: str, elapsed: float, latencies: list[float], statuses: dict[Any, int],
+              completed: int | None = None) -> dict[str, Any]:
+    """Summarize a load phase."""
+    completed = len(latencies) if completed is None else completed
+    return {
+        'name': name,
+        'elapsed': elapsed,
+        'throughput': completed / elapsed if elapsed else 0.0,
+        'statuses': statuses,
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+        'max': max(latencies, default=0.0),
+        'mean': statistics.fmean(latencies) if latencies else 0.0,
+    }
+
+
+def summarize_runs() -> dict[str, Any]:
+    """Aggregate the recorded sync runs into mean phase durations and request counts."""
+    return SyncRun.objects.aggregate(
+        runs=Count('pk'),
+        login=Avg('login_duration'),
+        crawl=Avg('crawl_duration'),
+        parse=Avg('parse_duration'),
+        list=Avg('list_duration'),
+        write=Avg('write_duration'),
+        moodle_requests=Sum('moodle_requests'),
+        google_requests=Sum('google_requests'),
+    )
+
+
+class ResourceMonitor:
+    """Measures CPU time, peak memory and thread count of this process."""
+
+    def __init__(self) -> None:
+        self.start_usage = resource.getrusage(resource.RUSAGE_SELF)
+        self.start_time = time.perf_counter()
+        self.peak_threads = threading.active_count()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+        self.thread.start()
+
+    def sample(self) -> None:
+        """Sample the thread count until stopped."""
+        while not self.stopped.wait(0.1):
+            self.peak_threads = max(self.peak_threads, threading.active_count())
+
+    def stop(self) -> dict[str, Any]:
+        """Stop sampling and report the resource use since creation."""
+        self.stopped.set()
+        self.thread.join()
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        wall = time.perf_counter() - self.start_time
+        cpu = (usage.ru_utime - self.start_usage.ru_utime
+               + usage.ru_stime - self.start_usage.ru_stime)
+        return {
+            'wall_seconds': wall,
+            'cpu_seconds': cpu,
+            'cpu_utilization': cpu / wall if wall else 0.0,
+            # ru_maxrss is in kilobytes on Linux
+            'peak_rss_mb': usage.ru_maxrss / 1024,
+            'peak_threads': self.peak_threads,
+            'pid': os.getpid(),
+        }
@@ -0,0 +1,67 @@
+"""Base class for the fake servers used by the load test."""
+from __future__ import annotations
+
+import collections
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeServer:
+    """Runs a request handler on a local port in a background thread and counts responses."""
+
+    def __init__(self, handler_class: type[BaseHTTPRequestHandler]) -> None:
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), handler_class)
+        self.httpd.daemon_threads = True
+        # let handlers reach the fake through `self.server.fake`
+        self.httpd.fake = self
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.lock = threading.Lock()
+        self.status_counts = collections.Counter()
+
+    @property
+    def url(self) -> str:
+        """Base URL of the server."""
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self) -> None:
+        """Start serving in the background."""
+        self.thread.start()
+
+    def stop(self) -> None:
+        """Stop serving and close the socket."""
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def count(self, status: int) -> None:
+        """Count a response with the given status."""
+        with self.lock:
+            self.status_counts[status] += 1
+
+
+class FakeRequestHandler(BaseHTTPRequestHandler):
+    """Request handler with helpers for the fake servers."""
+    protocol_version = 'HTTP/1.1'
+    # buffer the headers and body into one write to avoid delayed ACK stalls on keep-alive
+    wbufsize = 64 * 1024
+
+    def send(self, status: int, body: bytes = b'', content_type: str = 'text/html',
+             headers: dict[str, str] | None = None) -> None:
+        """Send a complete response."""
+        self.server.fake.count(status)
+        self.send_response(status)
+        self.send_header('Content-Type', f'{content_type}; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def read_body(self) -> bytes:
+        """Read the request body."""
+        length = int(self.headers.get('Content-Length', 0))
+        return self.rfile.read(length) if length else b''
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        """Silence the per-request log lines."""
@@ -0,0 +1,103 @@
+"""
+Guard the boot time of web workers with `python -X importtime`.
+
+The budget covers what booting the project adds to importing Django itself, measured as
+the difference to an interpreter importing only `django.core.wsgi`, so that it doesn't
+depend on how fast the machine imports Django.
+"""
+import os
+import re
+import resource
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# only needed once a sync or the OAuth flow runs, never at worker boot
+HEAVY_MODULES = [
+    'bs4',
+    'google_auth_oauthlib',
+    'googleapiclient',
+    'httplib2',
+    'jwt',
+    'requests',
+    'yaml',
+]
+
+# what every worker imports before the project, the baseline of the budget
+BASELINE_CODE = 'import django.core.wsgi'
+
+IMPORT_TIME_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+class Command(BaseCommand):
+    """Guard the boot time of web workers with `python -X importtime`."""
+    help = ('Boots a web worker (settings, WSGI application and URLconf) in a fresh '
+            'interpreter and fails if it imports heavy sync dependencies or if the import '
+            'time it adds to Django exceeds the budget.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--budget-ms', type=float, default=300.0,
+                            help='maximum import time the project adds to importing Django, '
+                                 'in milliseconds')
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='number of runs, the fastest one is reported')
+        parser.add_argument('--top', type=int, default=10,
+                            help='number of slowest top-level imports to show')
+
+    def handle(self, *args, **options):
+        worker_code = (f'{BASELINE_CODE}; django.core.wsgi.get_wsgi_application(); '
+                       f'import {settings.ROOT_URLCONF}')
+        runs = []
+        baseline_runs = []
+        for _ in range(options['repeat']):
+            # alternate the runs so that both see the same load of the machine
+            runs.append(self.measure(worker_code))
+            baseline_runs.append(self.measure(BASELINE_CODE)[0])
+        total_us, imports = min(runs, key=lambda run: run[0])
+        baseline_us = min(baseline_runs)
+        peak_rss_mb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+        added_us = total_us - baseline_us
+
+        self.stdout.write(f'Worker import time: {total_us / 1000:.1f} ms, of which Django '
+                          f'{baseline_us / 1000:.1f} ms and the project {added_us / 1000:.1f} ms '
+                          f'(budget {options["budget_ms"]:.0f} ms), peak RSS {peak_rss_mb:.1f} MB')
+        top_level = sorted(((cumulative, name) for name, level, cumulative in imports
+                            if level == 0), reverse=True)
+        for cumulative, name in top_level[:options['top']]:
+            self.stdout.write(f'  {cumulative / 1000:8.1f} ms  {name}')
+
+        errors = []
+        heavy = sorted({name.split('.')[0] for name, _, _ in imports} & set(HEAVY_MODULES))
+        if heavy:
+            errors.append(f'heavy modules imported at boot: {", ".join(heavy)}')
+        if added_us / 1000 > options['budget_ms']:
+            errors.append(f'import time {added_us / 1000:.1f} ms exceeds the budget')
+        if errors:
+            raise CommandError('; '.join(errors))
+        self.stdout.write(self.style.SUCCESS('Worker boot is within budget.'))
+
+    @staticmethod
+    def measure(code):
+        """Run `code` in a new interpreter, returns total import time and (name, level, time)."""
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': os.environ['DJANGO_SETTINGS_MODULE']}
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', code],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True, check=False)
+        if result.returncode != 0:
+            raise CommandError(f'Worker failed to boot:\n{result.stderr}')
+
+        imports = []
+        total_us = 0
+        for line in result.stderr.splitlines():
+            match = IMPORT_TIME_LINE.match(line)
+            if not match:
+                continue
+            cumulative = int(match[2])
+            # nested imports are indented by two spaces per level
+            level = (len(match[3]) - 1) // 2
+            imports.append((match[4], level, cumulative))
+            if level == 0:
+                total_us += cumulative
+        return total_us, imports
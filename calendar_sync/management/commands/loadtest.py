@@ -0,0 +1,120 @@
+"""Load test the sync endpoint and scheduler against local fake servers."""
+import os
+import tempfile
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import (override_settings, setup_test_environment,
+                               teardown_test_environment)
+
+from calendar_sync.loadtest import harness
+from calendar_sync.loadtest.fake_google import FakeGoogleCalendar
+from calendar_sync.loadtest.fake_moodle import FakeMoodle
+
+
+class Command(BaseCommand):
+    """Load test the sync endpoint and scheduler against local fake servers."""
+    help = ('Runs syncs of synthetic users against fake Moodle and Google Calendar servers '
+            'in a throwaway database and reports throughput, latency and resource use.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--phase', choices=['endpoint', 'scheduler', 'both'], default='both')
+        parser.add_argument('--months', type=int, default=2)
+        parser.add_argument('--assignments-per-month', type=int, default=5)
+        parser.add_argument('--moodle-latency', type=float, default=0.05,
+                            help='mean latency of Moodle pages in seconds')
+        parser.add_argument('--moodle-error-rate', type=float, default=0.0)
+        parser.add_argument('--moodle-change-rate', type=float, default=0.1,
+                            help='probability that a submission status flips between syncs')
+        parser.add_argument('--moodle-max-concurrency', type=int, default=8,
+                            help='cap on the requests in flight to Moodle')
+        parser.add_argument('--moodle-max-rps', type=float, default=10.0,
+                            help='cap on the requests per second to Moodle, 0 for no cap')
+        parser.add_argument('--profile-sample-rate', type=float, default=0.0,
+                            help='share of the syncs to profile, to measure its overhead')
+        parser.add_argument('--google-latency', type=float, default=0.02)
+        parser.add_argument('--google-user-quota', type=int, default=600,
+                            help='requests per minute per user')
+        parser.add_argument('--google-quota', type=int, default=500,
+                            help='requests per second in total')
+
+    def handle(self, *args, **options):
+        moodle = FakeMoodle(
+            assignments_per_month=options['assignments_per_month'],
+            latency=options['moodle_latency'],
+            error_rate=options['moodle_error_rate'],
+            change_rate=options['moodle_change_rate'])
+        google = FakeGoogleCalendar(
+            user_quota_per_minute=options['google_user_quota'],
+            quota_per_second=options['google_quota'],
+            latency=options['google_latency'])
+        moodle.start()
+        google.start()
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            config_path = os.path.join(tmp_dir, 'sync_config.yaml')
+            harness.write_sync_config(
+                config_path, moodle.url, google.api_endpoint, options['months'],
+                moodle_max_concurrency=options['moodle_max_concurrency'],
+                moodle_max_rps=options['moodle_max_rps'],
+                profile_sample_rate=options['profile_sample_rate'])
+            # a file database so that the request threads share it
+            connection.settings_dict['TEST']['NAME'] = os.path.join(tmp_dir, 'loadtest.sqlite3')
+
+            setup_test_environment()
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+            try:
+                with override_settings(CALENDAR_SYNC_CONFIG=config_path,
+                                       CALENDAR_SYNC_ACCOUNT_CONFIG=None, MEDIA_ROOT=tmp_dir):
+                    results = self.run_phases(options)
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+                teardown_test_environment()
+                moodle.stop()
+                google.stop()
+
+        self.report(results, moodle, google)
+
+    def run_phases(self, options):
+        """Run the selected load phases."""
+        user_ids = harness.create_users(options['users'])
+        monitor = harness.ResourceMonitor()
+        results = {'phases': []}
+        if options['phase'] in ('endpoint', 'both'):
+            results['phases'].append(harness.run_endpoint_load(user_ids, options['concurrency']))
+        if options['phase'] in ('scheduler', 'both'):
+            results['phases'].append(harness.run_scheduler_load())
+        results['resources'] = monitor.stop()
+        results['runs'] = harness.summarize_runs()
+        return results
+
+    def report(self, results, moodle, google):
+        """Print the results."""
+        for phase in results['phases']:
+            self.stdout.write(self.style.MIGRATE_HEADING(phase['name']))
+            self.stdout.write(
+                f"  elapsed {phase['elapsed']:.2f}s, throughput {phase['throughput']:.2f} syncs/s")
+            self.stdout.write(
+                f"  latency mean {phase['mean']:.3f}s, p50 {phase['p50']:.3f}s, "
+                f"p95 {phase['p95']:.3f}s, p99 {phase['p99']:.3f}s, max {phase['max']:.3f}s")
+            self.stdout.write(f"  outcomes {phase['statuses']}")
+
+        runs = results['runs']
+        self.stdout.write(self.style.MIGRATE_HEADING(f"sync runs ({runs['runs']})"))
+        if runs['runs']:
+            self.stdout.write('  mean phase durations ' + ', '.join(
+                f'{phase} {runs[phase]:.3f}s'
+                for phase in ('login', 'crawl', 'parse', 'list', 'write')))
+            self.stdout.write(f"  requests moodle {runs['moodle_requests']}, "
+                              f"google {runs['google_requests']}")
+
+        resources = results['resources']
+        self.stdout.write(self.style.MIGRATE_HEADING('django process'))
+        self.stdout.write(
+            f"  cpu {resources['cpu_seconds']:.2f}s ({resources['cpu_utilization']:.0%} of wall), "
+            f"peak rss {resources['peak_rss_mb']:.1f} MB, peak threads {resources['peak_threads']}")
+        self.stdout.write(self.style.MIGRATE_HEADING('fake servers'))
+        self.stdout.write(f'  moodle responses {dict(moodle.status_counts)}')
+        self.stdout.write(f'  google responses {dict(google.status_counts)}')
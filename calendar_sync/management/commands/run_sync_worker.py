@@ -0,0 +1,65 @@
+"""Run a worker that claims and runs due sync jobs."""
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from calendar_sync import jobs
+from calendar_sync.sync import circuit
+from calendar_sync.views import trigger_background_sync
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """Run a worker that claims and runs due sync jobs."""
+    help = ('Claims due sync jobs from the database and runs them. Start one worker per core '
+            'and per machine; use --shard/--shards to split users between groups of workers.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=4,
+                            help='number of users synced at the same time')
+        parser.add_argument('--shard', type=int, default=0)
+        parser.add_argument('--shards', type=int, default=1)
+        parser.add_argument('--poll-interval', type=float, default=10.0,
+                            help='seconds to wait when no job is due')
+        parser.add_argument('--once', action='store_true',
+                            help='exit when no job is due instead of polling')
+
+    def handle(self, *args, **options):
+        if not 0 <= options['shard'] < options['shards']:
+            raise CommandError('--shard must be between 0 and --shards - 1.')
+
+        worker_id = jobs.make_worker_id()
+        concurrency = options['concurrency']
+        logger.info('Sync worker %s started on shard %d/%d.',
+                    worker_id, options['shard'], options['shards'])
+
+        running = set()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            while True:
+                # refill free slots as soon as any job finishes, unless a service is down
+                claimed = []
+                if circuit.retry_after() == 0:
+                    claimed = jobs.claim(worker_id, limit=concurrency - len(running),
+                                         shard=options['shard'], num_of_shards=options['shards'])
+                for schedule in claimed:
+                    running.add(executor.submit(self.run_job, schedule, worker_id))
+
+                if running:
+                    _, running = wait(running, timeout=options['poll_interval'],
+                                      return_when=FIRST_COMPLETED)
+                elif options['once']:
+                    break
+                else:
+                    time.sleep(options['poll_interval'])
+
+    @staticmethod
+    def run_job(schedule, worker_id):
+        """Run a job in an executor thread."""
+        try:
+            return jobs.run_job(schedule, worker_id, trigger_background_sync)
+        finally:
+            connections.close_all()
@@ -0,0 +1,27 @@
+# Generated by Django 5.0.7 on 2026-10-19 06:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncSchedule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.IntegerField(unique=True)),
+                ('moodle_session_id', models.CharField(blank=True, max_length=255)),
+                ('next_sync_at', models.DateTimeField(db_index=True)),
+                ('last_synced_at', models.DateTimeField(blank=True, null=True)),
+                ('last_active_at', models.DateTimeField(blank=True, null=True)),
+                ('nearest_deadline', models.DateTimeField(blank=True, null=True)),
+                ('change_rate', models.FloatField(default=0.0)),
+            ],
+        ),
+    ]
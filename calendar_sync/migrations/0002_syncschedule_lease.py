@@ -0,0 +1,33 @@
+# Generated by Django 5.0.7 on 2026-10-19 06:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calendar_sync', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='syncschedule',
+            name='attempts',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='syncschedule',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='syncschedule',
+            name='lease_expires_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='syncschedule',
+            name='lease_owner',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+    ]
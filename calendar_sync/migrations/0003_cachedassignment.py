@@ -0,0 +1,31 @@
+# Generated by Django 5.0.7 on 2026-10-19 06:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calendar_sync', '0002_syncschedule_lease'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CachedAssignment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.IntegerField(db_index=True)),
+                ('url', models.URLField(max_length=500)),
+                ('title', models.CharField(max_length=255)),
+                ('deadline', models.CharField(max_length=32)),
+                ('description', models.TextField(blank=True)),
+                ('can_submit', models.BooleanField(default=False)),
+                ('submission_status', models.CharField(max_length=32)),
+                ('vevent', models.TextField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'unique_together': {('user_id', 'url')},
+            },
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.0.7 on 2026-10-19 06:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calendar_sync', '0003_cachedassignment'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.IntegerField(db_index=True)),
+                ('trigger', models.CharField(choices=[('manual', 'Manual'), ('background', 'Background')], max_length=16)),
+                ('started_at', models.DateTimeField(db_index=True)),
+                ('duration', models.FloatField(db_index=True, default=0.0)),
+                ('login_duration', models.FloatField(default=0.0)),
+                ('crawl_duration', models.FloatField(default=0.0)),
+                ('parse_duration', models.FloatField(default=0.0)),
+                ('list_duration', models.FloatField(default=0.0)),
+                ('write_duration', models.FloatField(default=0.0)),
+                ('moodle_requests', models.IntegerField(default=0)),
+                ('google_requests', models.IntegerField(default=0)),
+                ('events_created', models.IntegerField(default=0)),
+                ('events_updated', models.IntegerField(default=0)),
+                ('events_deleted', models.IntegerField(default=0)),
+                ('outcome', models.CharField(choices=[('success', 'Success'), ('failure', 'Failure')], db_index=True, max_length=16)),
+                ('error', models.TextField(blank=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='FailedSyncRun',
+            fields=[
+            ],
+            options={
+                'verbose_name': 'failed sync run',
+                'ordering': ['-started_at'],
+                'proxy': True,
+                'indexes': [],
+                'constraints': [],
+            },
+            bases=('calendar_sync.syncrun',),
+        ),
+        migrations.CreateModel(
+            name='SlowSyncRun',
+            fields=[
+            ],
+            options={
+                'verbose_name': 'slowest sync run',
+                'ordering': ['-duration'],
+                'proxy': True,
+                'indexes': [],
+                'constraints': [],
+            },
+            bases=('calendar_sync.syncrun',),
+        ),
+    ]
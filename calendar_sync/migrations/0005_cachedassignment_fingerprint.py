@@ -0,0 +1,23 @@
+# Generated by Django 5.0.7 on 2026-10-19 06:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calendar_sync', '0004_syncrun'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cachedassignment',
+            name='fetched_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='cachedassignment',
+            name='fingerprint',
+            field=models.CharField(blank=True, max_length=500),
+        ),
+    ]
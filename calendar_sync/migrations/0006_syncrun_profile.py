@@ -0,0 +1,31 @@
+# Generated by Django 5.0.7 on 2026-10-19 07:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calendar_sync', '0005_cachedassignment_fingerprint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProfiledSyncRun',
+            fields=[
+            ],
+            options={
+                'verbose_name': 'profiled sync run',
+                'ordering': ['-started_at'],
+                'proxy': True,
+                'indexes': [],
+                'constraints': [],
+            },
+            bases=('calendar_sync.syncrun',),
+        ),
+        migrations.AddField(
+            model_name='syncrun',
+            name='profile',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -1,2 +1,111 @@
 """Models for the calendar_sync app."""
 from django.db import models
+
+
+class SyncSchedule(models.Model):
+    """Model for storing when and how often a user's calendar should be synced."""
+    user_id = models.IntegerField(unique=True)
+    # live Moodle session of the user, kept out of the admin
+    moodle_session_id = models.CharField(max_length=255, blank=True)
+    next_sync_at = models.DateTimeField(db_index=True)
+    last_synced_at = models.DateTimeField(null=True, blank=True)
+    last_active_at = models.DateTimeField(null=True, blank=True)
+    nearest_deadline = models.DateTimeField(null=True, blank=True)
+    change_rate = models.FloatField(default=0.0)
+    # lease held by the worker currently syncing the user, see `calendar_sync.jobs`
+    lease_owner = models.CharField(max_length=255, blank=True)
+    lease_expires_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.user_id} @ {self.next_sync_at}"
+
+
+class CachedAssignment(models.Model):
+    """Model for storing the most recently crawled assignments of a user."""
+    user_id = models.IntegerField(db_index=True)
+    url = models.URLField(max_length=500)
+    title = models.CharField(max_length=255)
+    deadline = models.CharField(max_length=32)
+    description = models.TextField(blank=True)
+    can_submit = models.BooleanField(default=False)
+    submission_status = models.CharField(max_length=32)
+    # iCalendar VEVENT rendered when the assignment changes, see `calendar_sync.feeds`
+    vevent = models.TextField()
+    # month view fingerprint and fetch time, see `calendar_sync.sync.crawler.needs_fetch`
+    fingerprint = models.CharField(max_length=500, blank=True)
+    fetched_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = [('user_id', 'url')]
+
+    def __str__(self):
+        return f"{self.user_id}: {self.title}"
+
+
+class SyncRun(models.Model):
+    """Model for storing the timings and outcome of a single sync."""
+    MANUAL = 'manual'
+    BACKGROUND = 'background'
+    TRIGGER_CHOICES = [
+        (MANUAL, 'Manual'),
+        (BACKGROUND, 'Background'),
+    ]
+    SUCCESS = 'success'
+    FAILURE = 'failure'
+    OUTCOME_CHOICES = [
+        (SUCCESS, 'Success'),
+        (FAILURE, 'Failure'),
+    ]
+
+    user_id = models.IntegerField(db_index=True)
+    trigger = models.CharField(max_length=16, choices=TRIGGER_CHOICES)
+    started_at = models.DateTimeField(db_index=True)
+    # durations in seconds
+    duration = models.FloatField(default=0.0, db_index=True)
+    login_duration = models.FloatField(default=0.0)
+    crawl_duration = models.FloatField(default=0.0)
+    parse_duration = models.FloatField(default=0.0)
+    list_duration = models.FloatField(default=0.0)
+    write_duration = models.FloatField(default=0.0)
+    moodle_requests = models.IntegerField(default=0)
+    google_requests = models.IntegerField(default=0)
+    events_created = models.IntegerField(default=0)
+    events_updated = models.IntegerField(default=0)
+    events_deleted = models.IntegerField(default=0)
+    outcome = models.CharField(max_length=16, choices=OUTCOME_CHOICES, db_index=True)
+    error = models.TextField(blank=True)
+    # CPU and memory report of profiled runs, see `calendar_sync.sync.profiling`
+    profile = models.JSONField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.user_id} {self.trigger} sync @ {self.started_at}"
+
+
+class SlowSyncRun(SyncRun):
+    """Proxy of `SyncRun` listing the slowest runs first in the admin."""
+
+    class Meta:
+        proxy = True
+        ordering = ['-duration']
+        verbose_name = 'slowest sync run'
+
+
+class FailedSyncRun(SyncRun):
+    """Proxy of `SyncRun` listing only failed runs in the admin."""
+
+    class Meta:
+        proxy = True
+        ordering = ['-started_at']
+        verbose_name = 'failed sync run'
+
+
+class ProfiledSyncRun(SyncRun):
+    """Proxy of `SyncRun` listing only the profiled runs in the admin."""
+
+    class Meta:
+        proxy = True
+        ordering = ['-started_at']
+        verbose_name = 'profiled sync run'
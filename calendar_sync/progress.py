@@ -0,0 +1,115 @@
+"""
+Live progress of the syncs running in this process, streamed as server-sent events.
+
+Syncs publish their progress events under the key their triggers are coalesced by, see
+`calendar_sync.coalescing`, from whatever thread they run in. Each open event stream of
+that key receives them on its event loop, so streams of different syncs of the same user,
+e.g. of other targets, don't mix. A stream subscribes and starts its sync on the loop
+consuming it, which under WSGI is not the loop of the view.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import threading
+from typing import TYPE_CHECKING, Any
+
+from .sync.exceptions import CircuitOpenException
+
+if TYPE_CHECKING:
+    from collections.abc import Awaitable, Callable, Hashable
+
+# seconds between comments sent on an idle stream, so proxies don't close it
+KEEPALIVE_INTERVAL = 15.0
+
+
+class Subscription:
+    """Progress events of the syncs with a key delivered to an event loop."""
+
+    def __init__(self, key: Hashable) -> None:
+        self.key = key
+        self.loop = asyncio.get_running_loop()
+        self.queue: asyncio.Queue[tuple[str, dict[str, Any]]] = asyncio.Queue()
+
+
+_lock = threading.Lock()
+_subscriptions: dict[Hashable, set[Subscription]] = {}
+
+
+def subscribe(key: Hashable) -> Subscription:
+    """Subscribe to the progress of the syncs with the key. Must be called on the event loop."""
+    subscription = Subscription(key)
+    with _lock:
+        _subscriptions.setdefault(key, set()).add(subscription)
+    return subscription
+
+
+def unsubscribe(subscription: Subscription) -> None:
+    """Stop delivering events to the subscription."""
+    with _lock:
+        subscriptions = _subscriptions.get(subscription.key, set())
+        subscriptions.discard(subscription)
+        if not subscriptions:
+            _subscriptions.pop(subscription.key, None)
+
+
+def publish(key: Hashable, event: str, data: dict[str, Any]) -> None:
+    """Deliver a progress event to the subscriptions of the key, from any thread."""
+    with _lock:
+        subscriptions = list(_subscriptions.get(key, ()))
+    for subscription in subscriptions:
+        try:
+            subscription.loop.call_soon_threadsafe(subscription.queue.put_nowait, (event, data))
+        except RuntimeError:
+            # the loop of a dropped stream has been closed
+            unsubscribe(subscription)
+
+
+def format_event(event: str, data: dict[str, Any]) -> str:
+    """Format an event of a `text/event-stream` response."""
+    return f'event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n'
+
+
+async def stream(key: Hashable, run_sync: Callable[[], Awaitable[dict[str, Any]]]):
+    """
+    Start `run_sync` and stream the progress events of the syncs with the key until it
+    finishes, ending with a `done` event carrying its counts or an `error` event.
+    """
+    # subscribe before starting the sync so that no event is missed
+    subscription = subscribe(key)
+    sync = asyncio.ensure_future(run_sync())
+    get = None
+    try:
+        while True:
+            get = asyncio.ensure_future(subscription.queue.get())
+            done, _ = await asyncio.wait(
+                {get, sync}, timeout=KEEPALIVE_INTERVAL, return_when=asyncio.FIRST_COMPLETED)
+            if get in done:
+                yield format_event(*get.result())
+                continue
+            get.cancel()
+            if sync in done:
+                break
+            yield ': keep-alive\n\n'
+
+        # events published right before the sync returned may still be queued
+        while not subscription.queue.empty():
+            yield format_event(*subscription.queue.get_nowait())
+        if sync.exception() is not None:
+            error = sync.exception()
+            data = {'error': f'{type(error).__name__}: {error}'}
+            if isinstance(error, CircuitOpenException):
+                data['retry_after'] = max(1, round(error.retry_after))
+            yield format_event('error', data)
+        else:
+            result = sync.result()
+            yield format_event('done', {
+                'assignments': len(result['assignments']),
+                'created': result['created'],
+                'updated': result['updated'],
+            })
+    finally:
+        # a dropped stream leaves the read of the next event pending
+        if get is not None:
+            get.cancel()
+        unsubscribe(subscription)
@@ -0,0 +1,53 @@
+"""Persisted records of sync runs."""
+from __future__ import annotations
+
+import contextlib
+import time
+from typing import TYPE_CHECKING
+
+from django.utils import timezone
+
+from .models import SyncRun
+from .sync.metrics import SyncMetrics
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+
+
+@contextlib.contextmanager
+def track_run(user_id: int, trigger: str) -> Iterator[SyncMetrics]:
+    """
+    Record a `SyncRun` for the sync run in the block, which should collect its metrics in
+    the yielded `SyncMetrics`. Exceptions are recorded as a failure and re-raised.
+    """
+    metrics = SyncMetrics()
+    started_at = timezone.now()
+    start = time.perf_counter()
+    run = SyncRun(user_id=user_id, trigger=trigger, started_at=started_at)
+    try:
+        yield metrics
+    except Exception as e:
+        run.outcome = SyncRun.FAILURE
+        run.error = f'{type(e).__name__}: {e}'
+        raise
+    else:
+        run.outcome = SyncRun.SUCCESS
+    finally:
+        run.duration = time.perf_counter() - start
+        save_run(run, metrics)
+
+
+def save_run(run: SyncRun, metrics: SyncMetrics) -> None:
+    """Copy the metrics into the run and save it."""
+    run.login_duration = metrics.durations['login']
+    run.crawl_duration = metrics.durations['crawl']
+    run.parse_duration = metrics.durations['parse']
+    run.list_duration = metrics.durations['list']
+    run.write_duration = metrics.durations['write']
+    run.moodle_requests = metrics.requests['moodle']
+    run.google_requests = metrics.requests['google']
+    run.events_created = metrics.created
+    run.events_updated = metrics.updated
+    run.events_deleted = metrics.deleted
+    run.profile = metrics.profile
+    run.save()
@@ -0,0 +1,126 @@
+"""
+Deadline-aware scheduling of background syncs.
+
+Each user's next sync time is derived from their nearest upcoming deadline, how often
+their assignments changed recently and when they were last active, bounded by
+`MIN_SYNC_INTERVAL` and the freshness guarantee `MAX_SYNC_INTERVAL`.
+"""
+from __future__ import annotations
+
+import datetime
+import logging
+from typing import TYPE_CHECKING, Any
+
+from django.utils import timezone
+
+from .models import SyncSchedule
+from .sync.utils import parse_deadline
+
+if TYPE_CHECKING:
+    from django.db.models import QuerySet
+
+    from .sync.records import Assignment
+
+logger = logging.getLogger(__name__)
+
+MIN_SYNC_INTERVAL = datetime.timedelta(minutes=5)
+MAX_SYNC_INTERVAL = datetime.timedelta(hours=24)
+RETRY_INTERVAL = datetime.timedelta(hours=1)
+
+# (time until nearest deadline, base interval), checked in order
+DEADLINE_INTERVALS = [
+    (datetime.timedelta(hours=6), datetime.timedelta(minutes=15)),
+    (datetime.timedelta(hours=24), datetime.timedelta(minutes=30)),
+    (datetime.timedelta(days=3), datetime.timedelta(hours=2)),
+    (datetime.timedelta(days=7), datetime.timedelta(hours=6)),
+]
+NO_DEADLINE_INTERVAL = datetime.timedelta(hours=12)
+
+# deadlines closer than this are never slowed down by inactivity
+URGENT_WINDOW = datetime.timedelta(hours=24)
+# (time since last activity, interval multiplier), checked in order
+INACTIVITY_FACTORS = [
+    (datetime.timedelta(days=60), 8),
+    (datetime.timedelta(days=14), 4),
+]
+
+# weight of the latest sync in the exponential moving average of changes per sync
+CHANGE_RATE_WEIGHT = 0.3
+
+
+def next_sync_interval(
+        now: datetime.datetime, nearest_deadline: datetime.datetime | None,
+        change_rate: float, last_active_at: datetime.datetime | None) -> datetime.timedelta:
+    """Compute how long to wait before syncing a user again."""
+    interval = NO_DEADLINE_INTERVAL
+    until_deadline = None
+    if nearest_deadline is not None and nearest_deadline > now:
+        until_deadline = nearest_deadline - now
+        for window, base_interval in DEADLINE_INTERVALS:
+            if until_deadline <= window:
+                interval = base_interval
+                break
+
+    # users whose assignments keep changing are synced more often
+    interval = interval / (1 + change_rate)
+
+    # users who have not used the extension for a while are synced less often
+    if last_active_at is not None and (until_deadline is None or until_deadline > URGENT_WINDOW):
+        for inactive_for, factor in INACTIVITY_FACTORS:
+            if now - last_active_at >= inactive_for:
+                interval *= factor
+                break
+
+    return max(MIN_SYNC_INTERVAL, min(interval, MAX_SYNC_INTERVAL))
+
+
+def get_nearest_deadline(
+        assignments: list[Assignment], now: datetime.datetime) -> datetime.datetime | None:
+    """Get the nearest deadline after `now` among the given assignments."""
+    deadlines = [parse_deadline(assign.deadline) for assign in assignments if assign.deadline]
+    upcoming = [deadline for deadline in deadlines if deadline > now]
+    return min(upcoming, default=None)
+
+
+def record_activity(user_id: int, session_id: str) -> SyncSchedule:
+    """Record that the user triggered a sync, remembering their latest Moodle session."""
+    now = timezone.now()
+    schedule, _ = SyncSchedule.objects.get_or_create(
+        user_id=user_id, defaults={'next_sync_at': now})
+    schedule.moodle_session_id = session_id
+    schedule.last_active_at = now
+    schedule.save(update_fields=['moodle_session_id', 'last_active_at'])
+    return schedule
+
+
+def record_sync(user_id: int, result: dict[str, Any]) -> SyncSchedule:
+    """Update the user's schedule with the result of a successful sync."""
+    now = timezone.now()
+    schedule, _ = SyncSchedule.objects.get_or_create(
+        user_id=user_id, defaults={'next_sync_at': now})
+    changes = result['created'] + result['updated']
+    schedule.change_rate = (CHANGE_RATE_WEIGHT * changes
+                            + (1 - CHANGE_RATE_WEIGHT) * schedule.change_rate)
+    schedule.nearest_deadline = get_nearest_deadline(result['assignments'], now)
+    schedule.last_synced_at = now
+    schedule.next_sync_at = now + next_sync_interval(
+        now, schedule.nearest_deadline, schedule.change_rate, schedule.last_active_at)
+    schedule.save(update_fields=[
+        'change_rate', 'nearest_deadline', 'last_synced_at', 'next_sync_at'])
+    logger.debug('Next sync of user %d scheduled at %s.', user_id, schedule.next_sync_at)
+    return schedule
+
+
+def defer(schedule: SyncSchedule, delay: datetime.timedelta = RETRY_INTERVAL) -> None:
+    """Push the user's next sync back by `delay`, e.g. after a failed sync."""
+    schedule.next_sync_at = timezone.now() + delay
+    schedule.save(update_fields=['next_sync_at'])
+
+
+def due_schedules(limit: int | None = None) -> QuerySet[SyncSchedule]:
+    """Get the schedules that are due, most overdue first."""
+    schedules = SyncSchedule.objects.filter(
+        next_sync_at__lte=timezone.now()).exclude(moodle_session_id='').order_by('next_sync_at')
+    if limit is not None:
+        schedules = schedules[:limit]
+    return schedules
@@ -1 +1,16 @@
-from . import calendar, config, crawler, exceptions, main
+"""
+Crawls NCKU Moodle and syncs the deadlines with Google Calendar.
+
+Submodules are imported on first attribute access (PEP 562), so that importing the
+package, e.g. from the views at URLconf load, does not pull in the Google client, bs4,
+requests and yaml until a sync actually runs.
+"""
+import importlib
+
+__all__ = ['calendar', 'config', 'crawler', 'exceptions', 'main', 'metrics', 'records', 'utils']
+
+
+def __getattr__(name):
+    if name in __all__:
+        return importlib.import_module(f'.{name}', __name__)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -1,13 +1,42 @@
 """
-Runs main.sync with default config.
+Runs main.sync with the given configs, or with default config if none is given.
+Many configs, or directories of them, are synced in parallel, see `batch`.
 """
+import argparse
+import os
 import sys
 
-from . import config, main
+from . import batch, config, main
 
-config_path = None
+parser = argparse.ArgumentParser(
+    prog='python -m calendar_sync.sync',
+    description='Sync Moodle deadlines to Google Calendar for each config.')
+parser.add_argument('configs', nargs='*',
+                    help='config files or directories of *.yaml configs')
+parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                    help='number of syncs to run in parallel (default: number of CPUs)')
+parser.add_argument('--timeout', type=float, default=None,
+                    help='seconds after which a sync is killed (default: no timeout)')
+parser.add_argument('--course', type=int, action='append', default=[], dest='course_ids',
+                    metavar='ID', help='sync only the assignments of this course, repeatable')
+parser.add_argument('--assignment', action='append', default=[], dest='assign_urls',
+                    metavar='URL', help='sync only this assignment, repeatable')
+args = parser.parse_args()
 
-if len(sys.argv) > 1:
-    config_path = sys.argv[1]
+# targets given on the command line apply to every config
+overrides = {}
+if args.course_ids or args.assign_urls:
+    overrides = {'course_ids': args.course_ids, 'assign_urls': args.assign_urls}
 
-main.sync(config=config.load_config(config_path))
+config_paths = batch.find_configs(args.configs)
+if args.configs and not config_paths:
+    parser.error(f'no *.yaml configs found in {", ".join(args.configs)}')
+if not config_paths or len(config_paths) == 1 and args.timeout is None:
+    sync_config = config.load_config(config_paths[0] if config_paths else None)
+    main.sync(config={**sync_config, **overrides})
+else:
+    results = batch.run_batch(config_paths, jobs=max(1, args.jobs), timeout=args.timeout,
+                              overrides=overrides)
+    print(batch.format_summary(results))
+    if any(result.outcome != batch.SUCCESS for result in results):
+        sys.exit(1)
@@ -0,0 +1,171 @@
+"""
+Runs many syncs in parallel, one process per config file.
+
+Each config runs in its own process so that a hung sync can be killed when it exceeds its
+timeout without affecting the others. At most `jobs` processes run at a time. Their Moodle
+politeness caps are shared through a temporary lock directory, unless the configs set one.
+"""
+from __future__ import annotations
+
+import collections
+import logging
+import multiprocessing
+import os
+import tempfile
+import time
+from dataclasses import dataclass
+from multiprocessing.connection import wait
+from typing import TYPE_CHECKING, Any
+
+from . import config, main
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable
+    from multiprocessing.connection import Connection
+
+logger = logging.getLogger(__name__)
+
+CONFIG_EXTENSIONS = ('.yaml', '.yml')
+
+SUCCESS = 'success'
+FAILURE = 'failure'
+TIMEOUT = 'timeout'
+
+
+@dataclass(slots=True)
+class BatchResult:
+    """Outcome of the sync of one config."""
+    config_path: str
+    outcome: str
+    duration: float
+    assignments: int = 0
+    created: int = 0
+    updated: int = 0
+    error: str = ''
+
+
+def find_configs(paths: Iterable[str]) -> list[str]:
+    """Expand the given files and directories into config files, in order."""
+    config_paths = []
+    for path in paths:
+        if os.path.isdir(path):
+            config_paths.extend(sorted(
+                os.path.join(path, name) for name in os.listdir(path)
+                if name.endswith(CONFIG_EXTENSIONS)))
+        else:
+            config_paths.append(path)
+    return config_paths
+
+
+def run_config(config_path: str, overrides: dict[str, Any], lock_dir: str | None,
+               conn: Connection) -> None:
+    """
+    Sync one config with the `overrides` applied in a child process and send the outcome
+    through `conn`. `lock_dir` is used if the config sets no `moodle_lock_dir`.
+    """
+    try:
+        sync_config = config.load_config(config_path)
+        if sync_config['moodle_lock_dir'] is None:
+            sync_config['moodle_lock_dir'] = lock_dir
+        result = main.sync({**sync_config, **overrides})
+    except Exception as e:  # pylint: disable=broad-except
+        logger.exception('Sync of %s failed.', config_path)
+        conn.send((FAILURE, 0, 0, 0, f'{type(e).__name__}: {e}'))
+    else:
+        conn.send((SUCCESS, len(result['assignments']), result['created'], result['updated'], ''))
+    finally:
+        conn.close()
+
+
+def run_batch(config_paths: list[str], jobs: int, timeout: float | None = None,
+              overrides: dict[str, Any] | None = None) -> list[BatchResult]:
+    """
+    Sync the configs with up to `jobs` processes, killing the syncs that run longer than
+    `timeout` seconds. `overrides` are applied to every config.
+    Returns the results in the order of `config_paths`.
+    """
+    overrides = overrides or {}
+    # the caps on the requests to Moodle are per process, without a shared lock directory
+    # each of the parallel syncs would get all of them
+    shared_lock_dir = None
+    if min(jobs, len(config_paths)) > 1:
+        if os.name == 'posix':
+            shared_lock_dir = tempfile.TemporaryDirectory(prefix='calendar_sync_locks_')
+        else:
+            logger.warning('Moodle request caps are not shared between parallel syncs on %s.',
+                           os.name)
+    lock_dir = shared_lock_dir.name if shared_lock_dir else None
+    pending = collections.deque(config_paths)
+    # receiving end of the pipe -> (process, config path, start time)
+    running = {}
+    results = {}
+    while pending or running:
+        while pending and len(running) < jobs:
+            config_path = pending.popleft()
+            receiver, sender = multiprocessing.Pipe(duplex=False)
+            process = multiprocessing.Process(
+                target=run_config, args=(config_path, overrides, lock_dir, sender),
+                daemon=True)
+            process.start()
+            # keep only the child's copy of the sending end, so EOF means it exited
+            sender.close()
+            running[receiver] = (process, config_path, time.monotonic())
+            logger.info('Started sync of %s.', config_path)
+
+        wait_timeout = None
+        if timeout is not None:
+            oldest = min(start for _, _, start in running.values())
+            wait_timeout = max(0.0, oldest + timeout - time.monotonic())
+        for receiver in wait(list(running), timeout=wait_timeout):
+            process, config_path, start = running.pop(receiver)
+            try:
+                outcome, assignments, created, updated, error = receiver.recv()
+            except EOFError:
+                process.join()
+                outcome, assignments, created, updated = FAILURE, 0, 0, 0
+                error = f'process exited with code {process.exitcode}'
+            receiver.close()
+            process.join()
+            results[config_path] = BatchResult(
+                config_path, outcome, time.monotonic() - start,
+                assignments, created, updated, error)
+            logger.info('Sync of %s finished: %s.', config_path, outcome)
+
+        if timeout is not None:
+            now = time.monotonic()
+            for receiver, (process, config_path, start) in list(running.items()):
+                if now - start < timeout:
+                    continue
+                process.kill()
+                process.join()
+                receiver.close()
+                del running[receiver]
+                results[config_path] = BatchResult(
+                    config_path, TIMEOUT, now - start, error=f'timed out after {timeout:g}s')
+                logger.warning('Sync of %s timed out.', config_path)
+
+    if shared_lock_dir is not None:
+        shared_lock_dir.cleanup()
+    return [results[config_path] for config_path in config_paths]
+
+
+def format_summary(results: list[BatchResult]) -> str:
+    """Format the results as a table with a total row."""
+    header = ('config', 'outcome', 'duration', 'assignments', 'created', 'updated', 'error')
+    rows = [(result.config_path, result.outcome, f'{result.duration:.1f}s',
+             str(result.assignments), str(result.created), str(result.updated), result.error)
+            for result in results]
+    outcomes = collections.Counter(result.outcome for result in results)
+    rows.append((
+        'total', ', '.join(f'{count} {outcome}' for outcome, count in outcomes.items()),
+        f'{sum(result.duration for result in results):.1f}s',
+        str(sum(result.assignments for result in results)),
+        str(sum(result.created for result in results)),
+        str(sum(result.updated for result in results)), ''))
+
+    widths = [max(len(row[i]) for row in [header, *rows]) for i in range(len(header))]
+    lines = ['  '.join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip()
+             for row in [header, *rows]]
+    lines.insert(1, '  '.join('-' * width for width in widths))
+    lines.insert(len(lines) - 1, lines[1])
+    return '\n'.join(lines)
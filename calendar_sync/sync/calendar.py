@@ -8,29 +8,55 @@ import logging
 import os
 from typing import TYPE_CHECKING, Any
 
+import httplib2
+from google.auth.exceptions import TransportError
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+
+from . import circuit
+from .metrics import SyncMetrics
+from .records import CalendarEvent
+from .transport import PooledHttp
 
 if TYPE_CHECKING:
+    from collections.abc import Callable
     from pathlib import Path
 
 logger = logging.getLogger(__name__)
 
 
+def is_google_failure(error: BaseException) -> bool:
+    """Check if the error means that Google Calendar API is down or throttling."""
+    if isinstance(error, HttpError):
+        return error.resp.status >= 500 or error.resp.status == 429
+    return isinstance(error, (TransportError, httplib2.HttpLib2Error, OSError))
+
+
 class GoogleCalendar:
     """
     Interact with Google Calendar API.
     """
 
-    def __init__(self, credentials_path: Path | str, user_token_path: Path | str) -> None:
+    def __init__(
+            self, credentials_path: Path | str, user_token_path: Path | str,
+            api_endpoint: str | None = None, metrics: SyncMetrics | None = None,
+            http_factory: Callable[[Credentials], Any] | None = PooledHttp) -> None:
         self.scopes = [
             'openid',
             'https://www.googleapis.com/auth/userinfo.email',
             'https://www.googleapis.com/auth/calendar',
         ]
         self.timezone = 'Asia/Taipei'
+        # overrides https://www.googleapis.com/calendar/v3/, e.g. to point at a fake server
+        self.api_endpoint = api_endpoint
+        self.metrics = metrics or SyncMetrics()
+        # makes the httplib2-compatible transport of the client from the credentials,
+        # None to let the client use its own httplib2 transport
+        self.http_factory = http_factory
+        self.breaker = circuit.get_breaker('google calendar', is_google_failure)
         self.credentials = self.load_credentials(credentials_path, user_token_path)
         self.service = self.build_service()
 
@@ -66,12 +92,29 @@ class GoogleCalendar:
 
     def build_service(self):
         """Build service object."""
-        return build('calendar', 'v3', credentials=self.credentials)
+        client_options = {'api_endpoint': self.api_endpoint} if self.api_endpoint else None
+        if self.http_factory is None:
+            return build('calendar', 'v3', credentials=self.credentials,
+                         client_options=client_options)
+        return build('calendar', 'v3', http=self.http_factory(self.credentials),
+                     client_options=client_options)
+
+    def execute(self, request) -> Any:
+        """
+        Execute a request built from the service through the circuit breaker.
+        Raises `CircuitOpenException` without sending the request if the API is failing.
+        """
+        return self.breaker.call(self.send, request)
+
+    def send(self, request) -> Any:
+        """Execute a request built from the service, counting it."""
+        self.metrics.count_request('google')
+        return request.execute()
 
     def list_calendars(self):
         """Lists all calendars the user has."""
         logger.debug('Listing calendars...')
-        calendars = self.service.calendarList().list().execute()
+        calendars = self.execute(self.service.calendarList().list())
         return calendars.get('items', [])
 
     def create_calendar(self, summary: str, description: str) -> str:
@@ -84,7 +127,7 @@ class GoogleCalendar:
             'description': description,
             'timeZone': self.timezone,
         }
-        calendar = self.service.calendars().insert(body=calendar).execute()
+        calendar = self.execute(self.service.calendars().insert(body=calendar))
         return calendar.get('id')
 
     def create_event(
@@ -107,7 +150,7 @@ class GoogleCalendar:
             },
             'colorId': color_id,
         }
-        event = self.service.events().insert(calendarId=calendar_id, body=event).execute()
+        event = self.execute(self.service.events().insert(calendarId=calendar_id, body=event))
         return event.get('htmlLink')
 
     def update_event(
@@ -129,21 +172,21 @@ class GoogleCalendar:
             'colorId': color_id,
         }
         events = self.service.events()
-        event = events.update(calendarId=calendar_id, eventId=event_id, body=event).execute()
+        event = self.execute(events.update(calendarId=calendar_id, eventId=event_id, body=event))
         return event.get('htmlLink')
 
     def delete_event(self, calendar_id: str, event_id: str) -> None:
         """Deletes an event with the given id."""
-        self.service.events().delete(calendarId=calendar_id, eventId=event_id).execute()
+        self.execute(self.service.events().delete(calendarId=calendar_id, eventId=event_id))
 
-    def list_events(self, calendar_id: str, time_min: str, time_max: str) -> list[dict[str, Any]]:
+    def list_events(self, calendar_id: str, time_min: str, time_max: str) -> list[CalendarEvent]:
         """Lists events of a calendar in the given time range."""
         events = self.service.events()
-        filtered_events = events.list(calendarId=calendar_id,
-                                      timeMin=time_min, timeMax=time_max).execute()
-        return filtered_events.get('items', [])
+        filtered_events = self.execute(events.list(calendarId=calendar_id,
+                                                   timeMin=time_min, timeMax=time_max))
+        return [CalendarEvent.from_api(item) for item in filtered_events.get('items', [])]
 
     def get_colors(self) -> dict[str, Any]:
         """Gets all available colors."""
-        colors = self.service.colors().get().execute()
+        colors = self.execute(self.service.colors().get())
         return colors
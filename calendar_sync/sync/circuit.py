@@ -0,0 +1,175 @@
+"""
+Circuit breakers around the services a sync depends on.
+
+A breaker is closed while the service is healthy. When the share of failed or slow calls
+in the rolling window crosses a threshold it opens, and calls fail fast with
+`CircuitOpenException` instead of waiting for timeouts. After `open_duration` it lets a
+probe call through (half-open); a healthy probe closes it again, a bad one reopens it.
+Breakers are shared by all syncs in the process, see `get_breaker`.
+
+Every state change starts a new generation, and only the results of calls admitted in the
+current one count, so a slow call admitted before a trip can't close the breaker as if it
+were the probe.
+"""
+from __future__ import annotations
+
+import collections
+import logging
+import threading
+import time
+from typing import TYPE_CHECKING, Any, TypeVar
+
+from .exceptions import CircuitOpenException
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    """Circuit breaker tripping on rolling error and latency thresholds."""
+
+    def __init__(
+            self, name: str, is_failure: Callable[[BaseException], bool],
+            window: float = 60.0, min_calls: int = 10, failure_threshold: float = 0.5,
+            slow_call_duration: float = 10.0, slow_call_threshold: float = 0.8,
+            open_duration: float = 60.0, half_open_calls: int = 1) -> None:
+        self.name = name
+        self.is_failure = is_failure
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_threshold = failure_threshold
+        self.slow_call_duration = slow_call_duration
+        self.slow_call_threshold = slow_call_threshold
+        self.open_duration = open_duration
+        self.half_open_calls = half_open_calls
+
+        self.lock = threading.Lock()
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.probes = 0
+        self.generation = 0
+        # (time, failed, slow) of the calls in the window
+        self.calls = collections.deque()
+
+    def retry_after(self) -> float:
+        """Seconds until the breaker lets a probe through, 0 if calls are allowed."""
+        with self.lock:
+            if self.state != OPEN:
+                return 0.0
+            return max(0.0, self.opened_at + self.open_duration - time.monotonic())
+
+    def check(self) -> None:
+        """
+        Raise `CircuitOpenException` if calls are rejected, without taking a half-open probe,
+        so callers can fail fast before queueing for the call.
+        """
+        with self.lock:
+            if self.state == OPEN:
+                remaining = self.opened_at + self.open_duration - time.monotonic()
+                if remaining > 0:
+                    raise CircuitOpenException(
+                        f'Circuit of {self.name} is open.', retry_after=remaining)
+            elif self.state == HALF_OPEN and self.probes >= self.half_open_calls:
+                raise CircuitOpenException(
+                    f'Circuit of {self.name} is half-open.', retry_after=self.open_duration)
+
+    def allow(self) -> int:
+        """
+        Raise `CircuitOpenException` if the call is not allowed, else return the generation
+        to pass to `record`.
+        """
+        with self.lock:
+            if self.state == OPEN:
+                remaining = self.opened_at + self.open_duration - time.monotonic()
+                if remaining > 0:
+                    raise CircuitOpenException(
+                        f'Circuit of {self.name} is open.', retry_after=remaining)
+                logger.info('Circuit of %s is half-open, probing.', self.name)
+                self.state = HALF_OPEN
+                self.generation += 1
+                self.probes = 0
+            if self.state == HALF_OPEN:
+                if self.probes >= self.half_open_calls:
+                    raise CircuitOpenException(
+                        f'Circuit of {self.name} is half-open.', retry_after=self.open_duration)
+                self.probes += 1
+            return self.generation
+
+    def record(self, failed: bool, duration: float, generation: int) -> None:
+        """
+        Record the outcome of a call `allow` admitted in `generation` and update the state.
+        Outcomes of calls admitted before the last state change are ignored.
+        """
+        now = time.monotonic()
+        slow = duration >= self.slow_call_duration
+        with self.lock:
+            if generation != self.generation:
+                return
+            if self.state == HALF_OPEN:
+                self.probes -= 1
+                if failed or slow:
+                    self.trip(now)
+                else:
+                    logger.info('Circuit of %s is closed.', self.name)
+                    self.state = CLOSED
+                    self.generation += 1
+                    self.calls.clear()
+                return
+
+            self.calls.append((now, failed, slow))
+            while self.calls and self.calls[0][0] < now - self.window:
+                self.calls.popleft()
+            if self.state == CLOSED and len(self.calls) >= self.min_calls:
+                failures = sum(1 for _, call_failed, _ in self.calls if call_failed)
+                slow_calls = sum(1 for _, _, call_slow in self.calls if call_slow)
+                if (failures / len(self.calls) >= self.failure_threshold
+                        or slow_calls / len(self.calls) >= self.slow_call_threshold):
+                    self.trip(now)
+
+    def trip(self, now: float) -> None:
+        """Open the breaker. Must be called with the lock held."""
+        logger.warning('Circuit of %s is open for %.0f seconds.', self.name, self.open_duration)
+        self.state = OPEN
+        self.opened_at = now
+        self.generation += 1
+        self.calls.clear()
+
+    def call(self, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """Call `func` through the breaker."""
+        generation = self.allow()
+        start = time.monotonic()
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as e:
+            self.record(self.is_failure(e), time.monotonic() - start, generation)
+            raise
+        self.record(False, time.monotonic() - start, generation)
+        return result
+
+
+_breakers: dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name: str, is_failure: Callable[[BaseException], bool],
+                **kwargs: Any) -> CircuitBreaker:
+    """Get the process-wide breaker of the service `name`, creating it on first use."""
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name, is_failure, **kwargs)
+        return _breakers[name]
+
+
+def retry_after() -> float:
+    """Seconds until every breaker of the process lets calls through again."""
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return max((breaker.retry_after() for breaker in breakers), default=0.0)
@@ -16,13 +16,45 @@ if TYPE_CHECKING:
 
 logger = logging.getLogger(__name__)
 
+# directory of the files kept between runs, such as the cached Moodle sessions
+APP_DATA_DIR = os.path.join(
+    os.environ.get('XDG_DATA_HOME') or os.path.expanduser('~/.local/share'), 'calendar_sync')
+
 DEFAULT_CONFIG = {
+    # write the assignments to Google Calendar, or only crawl them, e.g. for the feeds
+    'write_calendar': True,
     'google_api_path': 'api_credentials.json',
     'google_token_path': 'token.json',
+    'google_api_endpoint': None,
+    # 'pooled' shares keep-alive connections between clients, 'httplib2' is the client default
+    'google_transport': 'pooled',
+    'google_timeout': 30,
+    'google_pool_connections': 4,
+    'google_pool_maxsize': 32,
+    'moodle_url': 'https://moodle.ncku.edu.tw',
     'moodle_session_id': None,
     'moodle_cred_path': 'moodle_credentials.json',
+    # file keeping the Moodle session between runs, under `APP_DATA_DIR` if not given
+    'moodle_session_cache_path': None,
+    # caps on the requests to the Moodle host shared by all syncs of the process, and of all
+    # processes on the machine sharing `moodle_lock_dir`
+    'moodle_max_concurrency': 8,
+    'moodle_max_rps': 10,
+    'moodle_lock_dir': None,
     'login_with_token': False,
     'num_of_months': 6,
+    # event descriptions longer than this are cut, ending with a link to the assignment
+    'description_max_length': 2000,
+    # sync only the assignments of these courses and these assignment pages, if any is given
+    'course_ids': (),
+    'assign_urls': (),
+    # file keeping the crawled assignments between runs, so unchanged pages are not fetched
+    'assign_cache_path': None,
+    'detail_max_age': 24 * 60 * 60,
+    'status_refresh_window': 3 * 24 * 60 * 60,
+    # profile every sync, or the given share of them, see `profiling`
+    'profile': False,
+    'profile_sample_rate': 0.0,
 }
 
 
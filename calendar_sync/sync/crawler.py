@@ -3,25 +3,48 @@ from __future__ import annotations
 
 import json
 import logging
+import os
+import re
+import time
 from typing import TYPE_CHECKING, Any
 
 import bs4
 import requests
 
-from calendar_sync.sync.utils import get_next_k_month_timestamp, parse_date
+from calendar_sync.sync.utils import (get_assign_id, get_next_k_month_timestamp,
+                                      parse_date, parse_deadline)
 
-from .exceptions import ElementNotFoundException
+from . import circuit, politeness
+from .description import DESCRIPTION_MAX_LENGTH, normalize_description
+from .exceptions import ElementNotFoundException, LoginFailedException
+from .metrics import SyncMetrics
+from .records import Assignment, MonthEvent
 
 if TYPE_CHECKING:
+    from collections.abc import Iterable
     from pathlib import Path
 
 logger = logging.getLogger(__name__)
 
 MOODLE_URL = 'https://moodle.ncku.edu.tw'
-LOGIN_URL = 'https://moodle.ncku.edu.tw/login/index.php'
-CALENDAR_URL = 'https://moodle.ncku.edu.tw/calendar/view.php?view=month&time={}'
+LOGIN_PATH = '/login/index.php'
+CALENDAR_PATH = '/calendar/view.php?view=month&time={}'
+COURSE_CALENDAR_PATH = CALENDAR_PATH + '&course={}'
+ASSIGN_PATH = '/mod/assign/view.php?id={}'
+# page that redirects to the login page when the session is not logged in
+SESSION_PROBE_PATH = '/my/'
+LOGIN_URL = MOODLE_URL + LOGIN_PATH
+CALENDAR_URL = MOODLE_URL + CALENDAR_PATH
 
 PARSER = 'html.parser'
+# seconds to wait for Moodle to respond
+REQUEST_TIMEOUT = 30
+# seconds after which an unchanged assignment page is fetched again
+DETAIL_MAX_AGE = 24 * 60 * 60
+# seconds around the deadline in which the page of an unsubmitted assignment is always fetched
+STATUS_REFRESH_WINDOW = 3 * 24 * 60 * 60
+# time of day shown next to an event in the month view
+EVENT_TIME_PATTERN = re.compile(r'\b([01]?\d|2[0-3]):([0-5]\d)\b')
 DEFAULT_HEADERS = {
     'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_11_6) '
     'AppleWebKit/537.36 (KHTML, like Gecko) '
@@ -30,37 +53,198 @@ DEFAULT_HEADERS = {
 }
 
 
+def is_moodle_failure(error: BaseException) -> bool:
+    """Check if the error means that Moodle is down or overloaded."""
+    if isinstance(error, requests.HTTPError):
+        return error.response is not None and (
+            error.response.status_code >= 500 or error.response.status_code == 429)
+    return isinstance(error, (requests.ConnectionError, requests.Timeout))
+
+
+def get_event_timestamp(day: bs4.Tag | None, item: bs4.Tag | None) -> str:
+    """
+    Get the Unix time an event of the month view is due at, from the midnight timestamp of
+    its day cell and the time of day shown in the entry, or just the day if none is shown.
+    """
+    if day is None:
+        return ''
+    timestamp = int(day['data-day-timestamp'])
+    match = EVENT_TIME_PATTERN.search(item.get_text(' ')) if item else None
+    if match:
+        timestamp += int(match[1]) * 60 * 60 + int(match[2]) * 60
+    return str(timestamp)
+
+
+def needs_fetch(assign: Assignment, event: MonthEvent, now: float,
+                max_age: float = DETAIL_MAX_AGE,
+                refresh_window: float = STATUS_REFRESH_WINDOW) -> bool:
+    """Check if the page of a previously crawled assignment has to be fetched again."""
+    if assign.fingerprint != event.fingerprint:
+        return True
+    if now - assign.fetched_at > max_age:
+        return True
+    # the submission status is what changes close to the deadline
+    deadline = parse_deadline(assign.deadline).timestamp()
+    return assign.submission_status != 'submitted' and abs(deadline - now) <= refresh_window
+
+
 class MoodleCrawler:
     """Crawler that crawls the calendar of NCKU Moodle site."""
 
-    def __init__(self, session_id: str | None = None, login_cred_path: Path | str | None = None):
+    def __init__(
+            self, session_id: str | None = None, login_cred_path: Path | str | None = None,
+            session_cache_path: Path | str | None = None, moodle_url: str = MOODLE_URL,
+            metrics: SyncMetrics | None = None,
+            scheduler: politeness.HostScheduler | None = None,
+            description_max_length: int | None = DESCRIPTION_MAX_LENGTH):
         logger.debug('Initializing MoodleCrawler.')
         if session_id is None and login_cred_path is None:
             raise ValueError('Either session_id or login_cred_path must be specified.')
 
+        self.moodle_url = moodle_url.rstrip('/')
+        self.login_url = self.moodle_url + LOGIN_PATH
+        self.calendar_url = self.moodle_url + CALENDAR_PATH
+        self.course_calendar_url = self.moodle_url + COURSE_CALENDAR_PATH
         self.login_token = None
+        self.metrics = metrics or SyncMetrics()
+        self.breaker = circuit.get_breaker(f'moodle {self.moodle_url}', is_moodle_failure)
+        # shares the capacity of the Moodle host with the other crawlers of the process
+        self.scheduler = scheduler or politeness.get_scheduler(
+            self.moodle_url, is_failure=is_moodle_failure)
+        self.description_max_length = description_max_length
+        self.session_cache_path = session_cache_path
+        # values parsed from the home page of the logged in user, e.g. user id and sesskey
+        self.home_info = {}
         self.session = requests.Session()
         self.session.headers.update(DEFAULT_HEADERS)
         if session_id:
             logger.debug('Setting Moodle session id to %s.', session_id)
             self.session.cookies.set('MoodleSession', session_id)
         elif login_cred_path:
-            self.login(login_cred_path)
+            if self.load_session() and self.is_session_valid():
+                logger.debug('Reusing cached Moodle session.')
+            else:
+                self.login(login_cred_path)
+                self.save_session()
+
+    def load_session(self) -> bool:
+        """
+        Load cookies and cached home page values from `session_cache_path`.
+        Returns whether a cached session was loaded.
+        """
+        if self.session_cache_path is None or not os.path.exists(self.session_cache_path):
+            return False
+
+        logger.debug('Loading Moodle session from "%s".', self.session_cache_path)
+        try:
+            with open(self.session_cache_path, 'r', encoding='utf-8') as f:
+                cache = json.load(f)
+            for cookie in cache['cookies']:
+                self.session.cookies.set(
+                    cookie['name'], cookie['value'], domain=cookie['domain'], path=cookie['path'])
+        except (ValueError, KeyError, TypeError):
+            logger.warning('Invalid Moodle session cache "%s", ignoring.', self.session_cache_path)
+            self.session.cookies.clear()
+            return False
+        self.home_info = cache.get('home_info', {})
+        return True
+
+    def save_session(self) -> None:
+        """Save cookies and cached home page values to `session_cache_path`."""
+        if self.session_cache_path is None:
+            return
+
+        cache = {
+            'cookies': [
+                {'name': cookie.name, 'value': cookie.value,
+                 'domain': cookie.domain, 'path': cookie.path}
+                for cookie in self.session.cookies
+            ],
+            'home_info': self.home_info,
+        }
+        # the cookies grant access to the user's account, keep them private
+        directory = os.path.dirname(self.session_cache_path)
+        if directory:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+        tmp_path = f'{self.session_cache_path}.tmp'
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with open(fd, 'w', encoding='utf-8') as f:
+            json.dump(cache, f)
+        os.replace(tmp_path, self.session_cache_path)
+
+    def is_session_valid(self) -> bool:
+        """Check whether the session is logged in with a single request without a body."""
+        response = self.request('HEAD', self.moodle_url + SESSION_PROBE_PATH, allow_redirects=False)
+        if response.is_redirect:
+            return 'login' not in response.headers.get('Location', '')
+        return response.ok
+
+    def get_home_info(self) -> dict[str, str]:
+        """Get values from the home page of the current user, fetching it at most once."""
+        if not self.home_info:
+            self.parse_home_info(self.request('GET', self.moodle_url).text)
+        return self.home_info
+
+    def parse_home_info(self, html: str) -> None:
+        """Parse the user id and sesskey from the home page of a logged in user."""
+        soup = self.parse(html)
+        popover = soup.find('div', {'class': 'popover-region-notifications'})
+        if popover is None:
+            raise ElementNotFoundException('User id element not found.')
+        self.home_info['user_id'] = popover['data-userid']
+
+        sesskey = re.search(r'"sesskey":"([^"]+)"', html)
+        if sesskey:
+            self.home_info['sesskey'] = sesskey.group(1)
+
+    def request(self, method: str, url: str, **kwargs: Any) -> requests.Response:
+        """
+        Send a request to Moodle through its circuit breaker once the host scheduler gives
+        this crawler a slot, timed as part of the crawl phase.
+        Raises `CircuitOpenException` without sending the request if Moodle is failing.
+        """
+        kwargs.setdefault('timeout', REQUEST_TIMEOUT)
+        # fail fast instead of waiting for a slot only to be rejected
+        self.breaker.check()
+        with self.metrics.phase('crawl'):
+            return self.scheduler.call(id(self), self.breaker.call, self.send, method, url,
+                                       **kwargs)
+
+    def send(self, method: str, url: str, **kwargs: Any) -> requests.Response:
+        """
+        Send a request to Moodle, raising `requests.HTTPError` on server errors and
+        throttling.
+        """
+        self.metrics.count_request('moodle')
+        response = self.session.request(method, url, **kwargs)
+        if response.status_code >= 500 or response.status_code == 429:
+            response.raise_for_status()
+        return response
+
+    def parse(self, html: str) -> bs4.BeautifulSoup:
+        """Parse a page, timed as part of the parse phase."""
+        with self.metrics.phase('parse'):
+            return bs4.BeautifulSoup(html, PARSER)
 
     def get_user_id(self) -> str:
         """Get the user id of the current user."""
-        soup = bs4.BeautifulSoup(self.session.get(MOODLE_URL).text, PARSER)
-        popover = soup.find('div', {'class': 'popover-region-notifications'})
-        return popover['data-userid']
+        return self.get_home_info()['user_id']
+
+    def get_sesskey(self) -> str | None:
+        """Get the sesskey of the current session."""
+        return self.get_home_info().get('sesskey')
 
     def get_login_token(self):
         """Get the login token of the current user."""
-        soup = bs4.BeautifulSoup(self.session.get(MOODLE_URL).text, PARSER)
+        soup = self.parse(self.request('GET', self.moodle_url).text)
         token = soup.find('input', {'name': 'logintoken'})['value']
         return token
 
     def login(self, cred_path: Path | str) -> None:
-        """Login to Moodle with the given credentials in `cred_path`."""
+        """
+        Login to Moodle with the given credentials in `cred_path`.
+        Raises `LoginFailedException` if the session is not logged in afterwards.
+        """
         with open(cred_path, 'r', encoding='utf-8') as f:
             credentials = json.load(f)
             username = credentials['username']
@@ -74,7 +258,17 @@ class MoodleCrawler:
             'password': password,
             'logintoken': self.login_token,
         }
-        self.session.post(LOGIN_URL, data=payload)
+        response = self.request('POST', self.login_url, data=payload)
+
+        # a successful login redirects to the home page, cache its values right away
+        self.home_info = {}
+        try:
+            self.parse_home_info(response.text)
+        except ElementNotFoundException:
+            logger.debug('Login response is not the home page.')
+            # e.g. the login page again with an error, which must not be cached as a session
+            if not self.is_session_valid():
+                raise LoginFailedException('Moodle login failed.') from None
 
     def get_month_assign_urls(self, timestamps: list[int]) -> list[str]:
         """
@@ -85,38 +279,62 @@ class MoodleCrawler:
         and 2024-09-01, this method will return the URLs of all assignments in the month of 2024-08
         and 2024-09.
         """
-        assign_urls = []
+        return [event.url for event in self.get_month_assign_events(timestamps)]
+
+    def get_month_assign_events(self, timestamps: list[int],
+                                course_id: int | str | None = None) -> list[MonthEvent]:
+        """
+        Fetch the assignments listed in the months of the given timestamps, see
+        `get_month_assign_urls`, along with what the month view shows about them.
+        If `course_id` is given, only the assignments of that course are listed.
+        """
+        events = []
 
         for timestamp in timestamps:
-            soup = bs4.BeautifulSoup(self.session.get(
-                CALENDAR_URL.format(timestamp)).text, PARSER)
-            for event in soup.find_all('a', {'data-action': 'view-event'}):
-                href = event['href']
-                if 'assign' in href:
-                    assign_urls.append(href)
+            if course_id is None:
+                url = self.calendar_url.format(timestamp)
+            else:
+                url = self.course_calendar_url.format(timestamp, course_id)
+            html = self.request('GET', url).text
+            with self.metrics.phase('parse'):
+                soup = bs4.BeautifulSoup(html, PARSER)
+                for link in soup.find_all('a', {'data-action': 'view-event'}):
+                    href = link['href']
+                    if 'assign' not in href:
+                        continue
+                    item = link.find_parent(attrs={'data-region': 'event-item'})
+                    day = link.find_parent('td', attrs={'data-day-timestamp': True})
+                    course = link.find_parent(attrs={'data-course-id': True})
+                    events.append(MonthEvent(
+                        url=href,
+                        event_id=link.get('data-event-id', ''),
+                        name=(item.get('data-event-title') if item else None)
+                        or link.get_text(strip=True),
+                        timestamp=get_event_timestamp(day, item),
+                        course_id=course['data-course-id'] if course else '',
+                    ))
 
-        logger.info('Found %d assignments urls.', len(assign_urls))
+        logger.info('Found %d assignments urls.', len(events))
 
-        return assign_urls
+        return events
 
-    def get_assign_info(self, assign_url: str) -> dict[str, Any]:
+    def get_assign_info(self, assign_url: str) -> Assignment:
         """Fetch the information of the assignment with the given URL."""
-        soup = bs4.BeautifulSoup(self.session.get(assign_url).text, PARSER)
-        assign_info = {
-            'title': soup.find('div', {'role': 'main'}).find('h2').text.strip(),
-            'can_submit': False,
-            'deadline': None,
-            'submission_status': None,
-            'description': str(soup.find('div', {'id': 'intro'})),
-        }
+        html = self.request('GET', assign_url).text
+        with self.metrics.phase('parse'):
+            return self.parse_assign_info(html, assign_url)
+
+    def parse_assign_info(self, html: str, assign_url: str) -> Assignment:
+        """Parse the information of the assignment from its page."""
+        soup = bs4.BeautifulSoup(html, PARSER)
+        title = soup.find('div', {'role': 'main'}).find('h2').text.strip()
+        description = normalize_description(
+            soup.find('div', {'id': 'intro'}), assign_url, self.description_max_length)
 
         # get submission allowed date
         submission_allowed_date_th = soup.find(
             'div', {'class': 'box py-3 generalbox boxaligncenter submissionsalloweddates'})
-        if submission_allowed_date_th:
-            assign_info['can_submit'] = False
-        else:
-            assign_info['can_submit'] = True
+        can_submit = not submission_allowed_date_th
 
         # get submission status
         submission_status_th = soup.find('th', string='繳交狀態')
@@ -127,11 +345,11 @@ class MoodleCrawler:
             raise ElementNotFoundException('Submission status element not found.')
 
         if submission_status in ['沒有繳交作業', '這個作業還沒人繳交']:
-            assign_info['submission_status'] = 'not_submitted'
+            submission_status = 'not_submitted'
         elif submission_status.startswith('已繳交'):
-            assign_info['submission_status'] = 'submitted'
+            submission_status = 'submitted'
         else:
-            assign_info['submission_status'] = 'unknown'
+            submission_status = 'unknown'
 
         # Find the `<th>` tag by text and then the following `<td>` for the due date
         due_date_th = soup.find('th', string='規定繳交時間')
@@ -141,16 +359,66 @@ class MoodleCrawler:
         else:
             raise ElementNotFoundException('Due date element not found.')
 
-        # parse date
-        assign_info['deadline'] = parse_date(due_date)
+        # convert once here so the soup can be freed before the next page is fetched
+        return Assignment(
+            title=title,
+            deadline=parse_date(due_date),
+            description=description,
+            can_submit=can_submit,
+            submission_status=submission_status,
+            url=assign_url,
+        )
 
+    def get_next_k_month_assign_info(
+            self, k: int, known: dict[str, Assignment] | None = None,
+            max_age: float = DETAIL_MAX_AGE,
+            refresh_window: float = STATUS_REFRESH_WINDOW) -> list[Assignment]:
+        """
+        Get the information of the next `k` months' assignments.
+        `known` maps URLs to the assignments of the previous run. Their pages are only fetched
+        again if `needs_fetch` says so, otherwise the month view is all that is requested.
+        """
+        timestamps = get_next_k_month_timestamp(k=k)
+        events = self.get_month_assign_events(timestamps)
+        known = known or {}
+        now = time.time()
+        assign_info = []
+        for event in events:
+            assign = known.get(event.url)
+            if assign is None or needs_fetch(assign, event, now, max_age, refresh_window):
+                assign = self.get_assign_info(event.url)
+                assign.fingerprint = event.fingerprint
+                assign.fetched_at = now
+            assign_info.append(assign)
+        logger.info('Fetched %d of %d assignment pages.',
+                    sum(1 for assign in assign_info if assign.fetched_at == now), len(events))
         return assign_info
 
-    def get_next_k_month_assign_info(self, k: int) -> list[dict[str, Any]]:
-        """Get the information of the next `k` months' assignments."""
+    def get_targeted_assign_info(
+            self, k: int, course_ids: Iterable[int | str] = (), assign_urls: Iterable[str] = (),
+            known: dict[str, Assignment] | None = None) -> list[Assignment]:
+        """
+        Get the information of the next `k` months' assignments of the given courses and of
+        the assignments with the given URLs, always fetching their pages.
+        Only the ID is taken from the given URLs, the pages are fetched from this Moodle.
+        """
         timestamps = get_next_k_month_timestamp(k=k)
-        urls = self.get_month_assign_urls(timestamps)
+        fingerprints = {}
+        for course_id in course_ids:
+            for event in self.get_month_assign_events(timestamps, course_id=course_id):
+                fingerprints[event.url] = event.fingerprint
+        urls = [*fingerprints, *(self.moodle_url + ASSIGN_PATH.format(get_assign_id(url))
+                                  for url in assign_urls)]
+
+        known = known or {}
+        now = time.time()
         assign_info = []
-        for url in urls:
-            assign_info.append(self.get_assign_info(url))
+        for url in dict.fromkeys(urls):
+            assign = self.get_assign_info(url)
+            # pages not seen in a month view keep their last fingerprint
+            previous = known.get(url)
+            assign.fingerprint = fingerprints.get(url) or (previous.fingerprint if previous else '')
+            assign.fetched_at = now
+            assign_info.append(assign)
+        logger.info('Fetched %d targeted assignment pages.', len(assign_info))
         return assign_info
@@ -0,0 +1,239 @@
+"""
+Normalization of assignment descriptions into small, stable event descriptions.
+
+The intro of an assignment page is full of Moodle markup, inline styles and relative links.
+`normalize_description` keeps only the markup Google Calendar renders (bold, italic,
+underline, links, lists and line breaks), collapses whitespace, resolves links against the
+assignment page and truncates the result to a maximum length, ending it with a link back to
+the assignment. The output depends only on the page, so unchanged assignments compare equal
+to their events.
+"""
+from __future__ import annotations
+
+import html
+import re
+import urllib.parse
+from typing import TYPE_CHECKING
+
+import bs4
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+
+# maximum length of a description, Google Calendar accepts up to 8192 characters
+DESCRIPTION_MAX_LENGTH = 2000
+MORE_LINK_TEXT = '在 Moodle 查看完整說明'
+ELLIPSIS = '…'
+
+# tags kept as they are, and tags renamed to one of them
+INLINE_TAGS = {'a', 'b', 'i', 'u'}
+RENAMED_TAGS = {'strong': 'b', 'em': 'i', 'ins': 'u'}
+LIST_TAGS = {'ul', 'ol', 'li'}
+# tags whose content is dropped along with them
+DROPPED_TAGS = {
+    'script', 'style', 'noscript', 'template', 'iframe', 'object', 'embed', 'svg', 'math',
+    'form', 'button', 'input', 'select', 'textarea', 'img', 'video', 'audio',
+}
+# tags ending a line, the others are unwrapped into their content
+BLOCK_TAGS = {
+    'address', 'article', 'aside', 'blockquote', 'dd', 'div', 'dl', 'dt', 'figcaption',
+    'figure', 'footer', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'header', 'hr', 'main', 'nav',
+    'p', 'pre', 'section', 'table', 'tr',
+}
+# table cells, separated by a space
+CELL_TAGS = {'td', 'th'}
+LINK_SCHEMES = {'http', 'https', 'mailto'}
+
+WHITESPACE = re.compile(r'\s+')
+
+# tokens of the normalized description
+OPEN = 'open'
+CLOSE = 'close'
+TEXT = 'text'
+BREAK = 'break'
+
+
+def normalize_description(intro: bs4.Tag | None, assign_url: str,
+                          max_length: int | None = DESCRIPTION_MAX_LENGTH) -> str:
+    """
+    Normalize the intro element of the assignment page at `assign_url` into an event
+    description of at most `max_length` characters, None for no limit. A limit shorter than
+    the link back to the assignment leaves only that link.
+    """
+    if intro is None:
+        return ''
+    tokens = tidy(list(tokenize(intro, assign_url)))
+    return render(tokens, max_length, assign_url)
+
+
+def tokenize(node: bs4.Tag, base_url: str) -> Iterator[tuple[str, str]]:
+    """Walk the children of the node, yielding the tokens of the markup that is kept."""
+    for child in node.children:
+        if isinstance(child, bs4.element.PreformattedString):
+            # comments, CDATA, doctypes and the like
+            continue
+        if isinstance(child, bs4.NavigableString):
+            text = WHITESPACE.sub(' ', str(child))
+            if text:
+                yield TEXT, text
+            continue
+
+        name = RENAMED_TAGS.get(child.name, child.name)
+        if name in DROPPED_TAGS:
+            continue
+        if name == 'br':
+            yield BREAK, ''
+        elif name == 'a':
+            href = resolve_link(child.get('href'), base_url)
+            if href:
+                yield OPEN, f'<a href="{html.escape(href)}">'
+                yield from tokenize(child, base_url)
+                yield CLOSE, 'a'
+            else:
+                yield from tokenize(child, base_url)
+        elif name in INLINE_TAGS or name in LIST_TAGS:
+            yield OPEN, f'<{name}>'
+            yield from tokenize(child, base_url)
+            yield CLOSE, name
+        elif name in CELL_TAGS:
+            yield TEXT, ' '
+            yield from tokenize(child, base_url)
+        elif name in BLOCK_TAGS:
+            yield BREAK, ''
+            yield from tokenize(child, base_url)
+            yield BREAK, ''
+        else:
+            yield from tokenize(child, base_url)
+
+
+def resolve_link(href: str | None, base_url: str) -> str | None:
+    """Resolve a link against the page it is on, None if it is not a web or mail link."""
+    if not href:
+        return None
+    url = urllib.parse.urljoin(base_url, href.strip())
+    if urllib.parse.urlsplit(url).scheme not in LINK_SCHEMES:
+        return None
+    return url
+
+
+def tidy(tokens: list[tuple[str, str]]) -> list[tuple[str, str]]:
+    """
+    Drop the whitespace and line breaks that don't show: whitespace around line breaks and
+    list items, repeated line breaks, line breaks at either end or next to list items, and
+    empty elements.
+    """
+    result = []
+    for kind, value in tokens:
+        if kind == TEXT:
+            if not result or is_line_edge(result[-1]):
+                value = value.lstrip()
+            if result and result[-1][0] == TEXT:
+                value = WHITESPACE.sub(' ', result.pop()[1] + value)
+            if value:
+                result.append((kind, value))
+        elif kind == BREAK:
+            strip_trailing_space(result)
+            if result and not is_line_edge(result[-1]):
+                result.append((kind, value))
+        elif kind == CLOSE:
+            strip_trailing_space(result)
+            if value in LIST_TAGS and result and result[-1][0] == BREAK:
+                result.pop()
+            if result and result[-1][0] == OPEN and result[-1][1].startswith(f'<{value}'):
+                # the element is empty
+                result.pop()
+            else:
+                result.append((kind, value))
+        else:
+            if value[1:-1] in LIST_TAGS:
+                strip_trailing_space(result)
+                if result and result[-1][0] == BREAK:
+                    result.pop()
+            result.append((kind, value))
+
+    strip_trailing_space(result)
+    while result and result[-1][0] == BREAK:
+        result.pop()
+    return result
+
+
+def is_line_edge(token: tuple[str, str]) -> bool:
+    """Check if text after the token starts a new line."""
+    kind, value = token
+    if kind == BREAK:
+        return True
+    tag = value if kind == CLOSE else value[1:-1]
+    return tag in LIST_TAGS
+
+
+def strip_trailing_space(tokens: list[tuple[str, str]]) -> None:
+    """Strip the whitespace at the end of the last token if it is text."""
+    if tokens and tokens[-1][0] == TEXT:
+        text = tokens[-1][1].rstrip()
+        if text:
+            tokens[-1] = (TEXT, text)
+        else:
+            tokens.pop()
+
+
+def serialize(token: tuple[str, str]) -> str:
+    """Serialize a token."""
+    kind, value = token
+    if kind == TEXT:
+        return html.escape(value, quote=False)
+    if kind == BREAK:
+        return '<br>'
+    if kind == CLOSE:
+        return f'</{value}>'
+    return value
+
+
+def render(tokens: list[tuple[str, str]], max_length: int | None, assign_url: str) -> str:
+    """
+    Serialize the tokens. If that is longer than `max_length`, the text is cut so that the
+    open elements can be closed and a link to the full description fits.
+    """
+    full = ''.join(serialize(token) for token in tokens)
+    if max_length is None or len(full) <= max_length:
+        return full
+
+    more_link = f'<br><a href="{html.escape(assign_url)}">{MORE_LINK_TEXT}</a>'
+    budget = max_length - len(more_link)
+    parts = []
+    stack = []
+    length = 0
+    for kind, value in tokens:
+        closing = sum(len(f'</{tag}>') for tag in stack)
+        room = budget - length - closing
+        if kind == TEXT:
+            text = html.escape(value, quote=False)
+            if len(text) > room:
+                cut = cut_text(value, room - len(ELLIPSIS))
+                if cut:
+                    parts.append(cut + ELLIPSIS)
+                break
+        elif kind == OPEN:
+            tag = 'a' if value.startswith('<a ') else value[1:-1]
+            if len(value) + len(f'</{tag}>') > room:
+                break
+            stack.append(tag)
+        elif kind == CLOSE:
+            stack.pop()
+        elif len('<br>') > room:
+            break
+        part = serialize((kind, value))
+        parts.append(part)
+        length += len(part)
+
+    if not parts:
+        return more_link.removeprefix('<br>')
+    parts.extend(f'</{tag}>' for tag in reversed(stack))
+    return ''.join(parts) + more_link
+
+
+def cut_text(text: str, room: int) -> str:
+    """Cut the text so that it is at most `room` characters long once escaped."""
+    cut = text[:max(0, room)]
+    while cut and len(html.escape(cut, quote=False)) > room:
+        cut = cut[:-1]
+    return html.escape(cut.rstrip(), quote=False)
@@ -22,9 +22,25 @@ class InvalidConfigException(CalendarSyncException):
     """
 
 
+class LoginFailedException(CalendarSyncException):
+    """Exception when logging in to Moodle does not give a logged in session."""
+
+
 class ElementNotFoundException(CalendarSyncException):
     """Exception when crawler cannot locate an element."""
 
 
 class SubmissionStatusError(CalendarSyncException):
     """Exception when submission status is unexpected."""
+
+
+class CircuitOpenException(CalendarSyncException):
+    """
+    Exception when a service is failing and its circuit breaker rejects the call.
+
+    `retry_after` is the number of seconds until the service is probed again.
+    """
+
+    def __init__(self, message: str, retry_after: float) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after
@@ -3,81 +3,240 @@ Main module for calendar sync.
 """
 from __future__ import annotations
 
+import contextlib
 import datetime
+import functools
+import hashlib
 import logging
-from typing import Any
+import os
+import random
+from typing import TYPE_CHECKING, Any
 
+from calendar_sync.sync import profiling
 from calendar_sync.sync.calendar import GoogleCalendar
-from calendar_sync.sync.crawler import MoodleCrawler
+from calendar_sync.sync.config import APP_DATA_DIR
+from calendar_sync.sync.crawler import MoodleCrawler, is_moodle_failure
+from calendar_sync.sync.exceptions import InvalidConfigException
+from calendar_sync.sync.metrics import SyncMetrics
+from calendar_sync.sync.politeness import get_scheduler
+from calendar_sync.sync.records import Assignment
+from calendar_sync.sync.transport import PooledHttp, get_adapter
 from calendar_sync.sync.utils import (event_identical, get_cal_id,
-                                      get_color_id, get_iso_format_date)
+                                      get_color_id, get_iso_format_date,
+                                      is_valid_deadline, load_assignments,
+                                      parse_deadline, save_assignments)
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+    # called with the name and data of each progress event of a sync, see `sync`
+    ProgressHook = Callable[[str, dict[str, Any]], None]
 
 logger = logging.getLogger(__name__)
 
+# margin around the deadlines of a targeted sync within which its events are listed
+TARGET_MARGIN = datetime.timedelta(minutes=1)
+
+
+def get_http_factory(config: dict[str, Any]):
+    """Get the transport factory of the Google client selected by the config."""
+    if config['google_transport'] == 'httplib2':
+        return None
+    if config['google_transport'] != 'pooled':
+        msg = f'Unknown Google transport `{config["google_transport"]}`.'
+        raise InvalidConfigException(msg)
+    adapter = get_adapter(config['google_pool_connections'], config['google_pool_maxsize'])
+    return functools.partial(PooledHttp, timeout=config['google_timeout'], adapter=adapter)
+
+
+def get_moodle_scheduler(config: dict[str, Any]):
+    """Get the process-wide scheduler of the Moodle host with the caps of the config."""
+    return get_scheduler(config['moodle_url'].rstrip('/'),
+                         max_concurrency=config['moodle_max_concurrency'],
+                         max_rps=config['moodle_max_rps'],
+                         is_failure=is_moodle_failure,
+                         lock_dir=config['moodle_lock_dir'])
+
+
+def get_session_cache_path(config: dict[str, Any]) -> str:
+    """
+    Get the Moodle session cache of the config, by default a file under `APP_DATA_DIR` named
+    after the credentials so that configs of different accounts don't share a session.
+    """
+    if config['moodle_session_cache_path']:
+        return config['moodle_session_cache_path']
+    key = hashlib.sha256(os.path.abspath(config['moodle_cred_path']).encode()).hexdigest()
+    return os.path.join(APP_DATA_DIR, f'moodle_session_{key[:16]}.json')
+
 
-def sync(config: dict[str, Any]) -> None:
+def sync(config: dict[str, Any], metrics: SyncMetrics | None = None,
+         known_assignments: dict[str, Assignment] | None = None,
+         progress: ProgressHook | None = None) -> dict[str, Any]:
     """
     Crawls the calendar of NCKU Moodle site and syncs it with Google Calendar.
+    `known_assignments` are the assignments of the previous run keyed by URL, loaded from
+    `assign_cache_path` if not given.
+    Returns the crawled assignments, the number of created and updated events and the
+    metrics of the sync.
+    If `course_ids` or `assign_urls` are set in the config, only the assignments of those
+    courses and those assignments are synced.
+    If `write_calendar` is not set in the config, the assignments are only crawled and
+    Google Calendar is not used.
+    If `profile` is set in the config, or for a `profile_sample_rate` share of the syncs,
+    the sync is profiled into `metrics.profile`.
+    `progress` is called as the sync runs with
+    - `('phase', {'phase': name})` when it moves on to login, list (the calendars), crawl,
+      list_events or write,
+    - `('assignments', {'count': n})` once the assignments are crawled, and
+    - `('created', assignment)` or `('updated', assignment)` for each written event, with
+      the title, deadline and URL of the assignment.
     """
-    calendar_client = GoogleCalendar(config['google_api_path'], config['google_token_path'])
-    if config['login_with_token']:
-        moodle_crawler = MoodleCrawler(session_id=config['moodle_session_id'])
-    else:
-        moodle_crawler = MoodleCrawler(login_cred_path=config['moodle_cred_path'])
+    metrics = metrics or SyncMetrics()
+    progress = progress or (lambda event, data: None)
+    profiled = config['profile'] or random.random() < config['profile_sample_rate']
+    with profiling.profile(metrics) if profiled else contextlib.nullcontext():
+        return run_sync(config, metrics, known_assignments, progress)
+
+
+def run_sync(config: dict[str, Any], metrics: SyncMetrics,
+             known_assignments: dict[str, Assignment] | None,
+             progress: ProgressHook) -> dict[str, Any]:
+    """Run the sync described in `sync`."""
+    progress('phase', {'phase': 'login'})
+    with metrics.phase('login'):
+        if config['write_calendar']:
+            calendar_client = GoogleCalendar(config['google_api_path'], config['google_token_path'],
+                                             api_endpoint=config['google_api_endpoint'],
+                                             metrics=metrics,
+                                             http_factory=get_http_factory(config))
+        if config['login_with_token']:
+            moodle_crawler = MoodleCrawler(session_id=config['moodle_session_id'],
+                                           moodle_url=config['moodle_url'], metrics=metrics,
+                                           scheduler=get_moodle_scheduler(config),
+                                           description_max_length=config['description_max_length'])
+        else:
+            moodle_crawler = MoodleCrawler(login_cred_path=config['moodle_cred_path'],
+                                           session_cache_path=get_session_cache_path(config),
+                                           moodle_url=config['moodle_url'], metrics=metrics,
+                                           scheduler=get_moodle_scheduler(config),
+                                           description_max_length=config['description_max_length'])
 
     # get calendar id
-    calendars = calendar_client.list_calendars()
-    cal_id = get_cal_id(calendars, 'Moodle Deadline')
-    if cal_id is None:
-        logger.info('Moodle Deadline calendar not found, creating a new one.')
-        cal_id = calendar_client.create_calendar('Moodle Deadline', 'Deadline from Moodle')
-    else:
-        logger.info('Moodle Deadline calendar exists, won\'t create a new one.')
+    if config['write_calendar']:
+        progress('phase', {'phase': 'list'})
+        with metrics.phase('list'):
+            calendars = calendar_client.list_calendars()
+        cal_id = get_cal_id(calendars, 'Moodle Deadline')
+        if cal_id is None:
+            logger.info('Moodle Deadline calendar not found, creating a new one.')
+            with metrics.phase('write'):
+                cal_id = calendar_client.create_calendar('Moodle Deadline', 'Deadline from Moodle')
+        else:
+            logger.info('Moodle Deadline calendar exists, won\'t create a new one.')
 
-    # get next k months assignment info
+    # get next k months assignment info, or only that of the targeted courses and assignments
+    progress('phase', {'phase': 'crawl'})
     k = config['num_of_months']
-    assign_info = moodle_crawler.get_next_k_month_assign_info(k)
+    targeted = bool(config['course_ids'] or config['assign_urls'])
+    if known_assignments is None and config['assign_cache_path']:
+        known_assignments = load_assignments(config['assign_cache_path'])
+    if targeted:
+        assign_info = moodle_crawler.get_targeted_assign_info(
+            k, course_ids=config['course_ids'], assign_urls=config['assign_urls'],
+            known=known_assignments)
+    else:
+        assign_info = moodle_crawler.get_next_k_month_assign_info(
+            k, known=known_assignments, max_age=config['detail_max_age'],
+            refresh_window=config['status_refresh_window'])
+    # an unparsable deadline would fail the sync after the events are written, when the
+    # schedule and the feed are updated
+    valid_info = []
+    for assign in assign_info:
+        if is_valid_deadline(assign.deadline):
+            valid_info.append(assign)
+        else:
+            logger.warning('Skipping %s with invalid deadline %r.', assign.url, assign.deadline)
+    assign_info = valid_info
+    if config['assign_cache_path']:
+        cached = {**known_assignments} if targeted and known_assignments else {}
+        cached.update((assign.url, assign) for assign in assign_info)
+        save_assignments(config['assign_cache_path'], list(cached.values()))
     logger.info('Found %d assignments for next %d months.', len(assign_info), k)
+    progress('assignments', {'count': len(assign_info)})
+    if not config['write_calendar']:
+        return {'assignments': assign_info, 'created': 0, 'updated': 0, 'metrics': metrics}
 
     # Update the calendar
-    cal_events = calendar_client.list_events(cal_id, time_min=get_iso_format_date(
-        datetime.datetime.now()),
-        time_max=get_iso_format_date(
-        datetime.datetime.now(),
-        delta_month=k))
+    progress('phase', {'phase': 'list_events'})
+    if targeted:
+        # only the events at the deadlines of the targeted assignments can match them, at
+        # their previous deadlines too in case they moved
+        deadlines = [parse_deadline(assign.deadline) for assign in assign_info]
+        deadlines.extend(
+            parse_deadline(known_assignments[assign.url].deadline) for assign in assign_info
+            if known_assignments and assign.url in known_assignments
+            and is_valid_deadline(known_assignments[assign.url].deadline))
+        time_min = (min(deadlines) - TARGET_MARGIN).isoformat() if deadlines else None
+        time_max = (max(deadlines) + TARGET_MARGIN).isoformat() if deadlines else None
+    else:
+        time_min = get_iso_format_date(datetime.datetime.now())
+        time_max = get_iso_format_date(datetime.datetime.now(), delta_month=k)
+    cal_events = []
+    if assign_info:
+        with metrics.phase('list'):
+            cal_events = calendar_client.list_events(cal_id, time_min=time_min, time_max=time_max)
+
+    progress('phase', {'phase': 'write'})
 
     for assign in assign_info:
         logger.debug('Processing assignment %s.', assign)
 
-        color_id = get_color_id(assign['can_submit'], assign['submission_status'])
+        color_id = get_color_id(assign)
 
         # check if the assignment is already in the calendar
         exist = False
         for event in cal_events:
             # if the assignment is already in the calendar
-            if event['summary'] == assign['title']:
+            if event.summary == assign.title:
                 exist = True
                 logger.debug('assignment already exists in calendar.')
                 # update the event if the event is not identical
                 if not event_identical(event, assign):
                     logger.debug('events are not identical, updating event.')
-                    calendar_client.update_event(
-                        cal_id, event['id'],
-                        assign['title'],
-                        assign['deadline'],
-                        assign['deadline'],
-                        assign['description'],
-                        color_id=color_id)
+                    with metrics.phase('write'):
+                        calendar_client.update_event(
+                            cal_id, event.id,
+                            assign.title,
+                            assign.deadline,
+                            assign.deadline,
+                            assign.description,
+                            color_id=color_id)
+                    metrics.updated += 1
+                    progress('updated', describe(assign))
                 break
 
         # create the event if the assignment is not in the calendar
         if not exist:
             logger.debug('assignment does not exist in calendar, creating event.')
-            calendar_client.create_event(
-                cal_id, assign['title'],
-                assign['deadline'],
-                assign['deadline'],
-                assign['description'],
-                color_id=color_id)
+            with metrics.phase('write'):
+                calendar_client.create_event(
+                    cal_id, assign.title,
+                    assign.deadline,
+                    assign.deadline,
+                    assign.description,
+                    color_id=color_id)
+            metrics.created += 1
+            progress('created', describe(assign))
 
     logger.info('All assignments for the next %d months have been synced.', k)
+    return {
+        'assignments': assign_info,
+        'created': metrics.created,
+        'updated': metrics.updated,
+        'metrics': metrics,
+    }
+
+
+def describe(assign: Assignment) -> dict[str, str]:
+    """Describe an assignment in a progress event."""
+    return {'title': assign.title, 'deadline': assign.deadline, 'url': assign.url}
@@ -0,0 +1,52 @@
+"""Metrics collected while a sync runs."""
+from __future__ import annotations
+
+import collections
+import contextlib
+import time
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+
+PHASES = ('login', 'crawl', 'parse', 'list', 'write')
+
+
+class SyncMetrics:
+    """
+    Collects the duration of each phase, the number of HTTP requests per service and the
+    number of created, updated and deleted events of a sync.
+    """
+
+    def __init__(self) -> None:
+        self.durations = dict.fromkeys(PHASES, 0.0)
+        self.requests = collections.Counter()
+        self.created = 0
+        self.updated = 0
+        self.deleted = 0
+        self.current_phase = None
+        # report of `profiling.profile` if the sync was profiled
+        self.profile = None
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """
+        Time the block as part of the phase `name`.
+        Blocks nested in another phase are timed as part of the outer phase, e.g. the page
+        fetches made while logging in count as login rather than crawl.
+        """
+        if self.current_phase is not None:
+            yield
+            return
+
+        self.current_phase = name
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.durations[name] += time.perf_counter() - start
+            self.current_phase = None
+
+    def count_request(self, service: str) -> None:
+        """Count an HTTP request to the given service."""
+        self.requests[service] += 1
@@ -0,0 +1,242 @@
+"""
+Politeness scheduling of the requests to a Moodle host.
+
+All crawlers of a process share one `HostScheduler` per host (see `get_scheduler`), which
+- caps the number of requests in flight and the number of requests started per second,
+- serves the crawlers waiting for a slot round-robin, so a user with many pages to fetch
+  doesn't hold back everyone else, and
+- adapts the concurrency limit to the observed latency: it grows slowly while responses are
+  as fast as usual and is cut when they slow down or fail, like TCP congestion control.
+
+With `lock_dir` set, the caps also hold across processes on the machine, with slots and the
+request pacing coordinated through `fcntl` locks on files in that directory.
+"""
+from __future__ import annotations
+
+import collections
+import contextlib
+import hashlib
+import os
+import threading
+import time
+from typing import TYPE_CHECKING, Any, TypeVar
+
+from .exceptions import CircuitOpenException
+
+if TYPE_CHECKING:
+    from collections.abc import Callable, Hashable, Iterator
+    from pathlib import Path
+
+T = TypeVar('T')
+
+# weight of the latest response in the smoothed latency
+LATENCY_SMOOTHING = 0.2
+# how fast the baseline latency follows latencies above it
+BASELINE_DRIFT = 0.01
+# factor the concurrency limit is cut by when Moodle is congested
+DECREASE_FACTOR = 0.7
+# seconds to wait before retrying to get a slot held by another process
+LOCK_POLL_INTERVAL = 0.05
+
+
+class HostScheduler:
+    """Shares the request capacity of a host fairly between crawlers."""
+
+    def __init__(
+            self, host: str, max_concurrency: int = 8, min_concurrency: int = 1,
+            max_rps: float = 10.0, tolerance: float = 2.0, latency_slack: float = 0.25,
+            is_failure: Callable[[BaseException], bool] | None = None,
+            lock_dir: Path | str | None = None) -> None:
+        self.host = host
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.max_rps = max_rps
+        # latencies above `baseline * tolerance + latency_slack` mean the host is congested
+        self.tolerance = tolerance
+        self.latency_slack = latency_slack
+        self.is_failure = is_failure or (lambda error: False)
+        self.lock_dir = lock_dir
+
+        self.lock = threading.Lock()
+        self.limit = float(max_concurrency)
+        self.in_flight = 0
+        # requests waiting for a slot per key, and the keys in round-robin order
+        self.queues: dict[Hashable, collections.deque[threading.Event]] = {}
+        self.order: collections.deque[Hashable] = collections.deque()
+        self.next_start = 0.0
+        self.smoothed_latency: float | None = None
+        self.baseline_latency: float | None = None
+        self.last_decrease = 0.0
+
+    def call(self, key: Hashable, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """
+        Call `func` once a slot is free, queued fairly with the other callers. Callers that
+        send requests on behalf of the same user should pass the same `key`.
+        Calls rejected by a circuit breaker are not recorded, and calls failing without a
+        response, e.g. on a connection error, count as failures with no latency.
+        """
+        with self.slot(key):
+            start = time.monotonic()
+            try:
+                result = func(*args, **kwargs)
+            except CircuitOpenException:
+                raise
+            except BaseException as e:
+                latency = None
+                if getattr(e, 'response', None) is not None:
+                    latency = time.monotonic() - start
+                self.record(latency, self.is_failure(e))
+                raise
+            self.record(time.monotonic() - start, False)
+            return result
+
+    @contextlib.contextmanager
+    def slot(self, key: Hashable) -> Iterator[None]:
+        """Hold a request slot for the block, starting it no earlier than the rate allows."""
+        self.acquire(key)
+        try:
+            with self.process_slot():
+                self.pace()
+                yield
+        finally:
+            self.release()
+
+    def acquire(self, key: Hashable) -> None:
+        """Wait for a slot of this process."""
+        ticket = threading.Event()
+        with self.lock:
+            queue = self.queues.setdefault(key, collections.deque())
+            if not queue:
+                self.order.append(key)
+            queue.append(ticket)
+            self.dispatch()
+        ticket.wait()
+
+    def release(self) -> None:
+        """Give back a slot of this process."""
+        with self.lock:
+            self.in_flight -= 1
+            self.dispatch()
+
+    def dispatch(self) -> None:
+        """Hand the free slots to the waiting keys in turn. Must be called with the lock held."""
+        while self.order and self.in_flight < max(self.min_concurrency, int(self.limit)):
+            key = self.order.popleft()
+            queue = self.queues[key]
+            ticket = queue.popleft()
+            if queue:
+                self.order.append(key)
+            else:
+                del self.queues[key]
+            self.in_flight += 1
+            ticket.set()
+
+    def record(self, latency: float | None, failed: bool) -> None:
+        """
+        Adapt the concurrency limit to the latency of a finished request, None if it got no
+        response.
+        """
+        if latency is None and not failed:
+            return
+        now = time.monotonic()
+        with self.lock:
+            if latency is not None:
+                self.observe(latency)
+            congested = failed or self.smoothed_latency > (
+                self.baseline_latency * self.tolerance + self.latency_slack)
+            if congested:
+                # cut at most once per round trip, the requests in flight saw the same state
+                if now - self.last_decrease >= (self.smoothed_latency or 0.0):
+                    self.limit = max(self.min_concurrency, self.limit * DECREASE_FACTOR)
+                    self.last_decrease = now
+            else:
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            self.dispatch()
+
+    def observe(self, latency: float) -> None:
+        """Update the smoothed and baseline latency. Must be called with the lock held."""
+        if self.smoothed_latency is None:
+            self.smoothed_latency = self.baseline_latency = latency
+            return
+        self.smoothed_latency += LATENCY_SMOOTHING * (latency - self.smoothed_latency)
+        if latency < self.baseline_latency:
+            self.baseline_latency = latency
+        else:
+            self.baseline_latency += BASELINE_DRIFT * (latency - self.baseline_latency)
+
+    def pace(self) -> None:
+        """Sleep until the next request may start under the rate limit."""
+        if not self.max_rps:
+            return
+        interval = 1 / self.max_rps
+        if self.lock_dir is None:
+            with self.lock:
+                now = time.monotonic()
+                start = max(now, self.next_start)
+                self.next_start = start + interval
+        else:
+            start, now = self.reserve_start(interval)
+        if start > now:
+            time.sleep(start - now)
+
+    def lock_path(self, name: str) -> str:
+        """Path of a lock file of this host in `lock_dir`."""
+        digest = hashlib.sha1(self.host.encode()).hexdigest()[:16]
+        return os.path.join(self.lock_dir, f'moodle-{digest}.{name}')
+
+    def reserve_start(self, interval: float) -> tuple[float, float]:
+        """Reserve the next start time shared by all processes, returns it and the time now."""
+        import fcntl  # pylint: disable=import-outside-toplevel
+        with open(self.lock_path('rate'), 'a+', encoding='ascii') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            try:
+                next_start = float(f.read() or 0)
+            except ValueError:
+                next_start = 0.0
+            now = time.time()
+            start = max(now, next_start)
+            f.seek(0)
+            f.truncate()
+            f.write(repr(start + interval))
+            f.flush()
+        return start, now
+
+    @contextlib.contextmanager
+    def process_slot(self) -> Iterator[None]:
+        """
+        Hold one of the `max_concurrency` slots shared by all processes for the block.
+        The lock of a slot is released by the OS even if its process dies.
+        """
+        if self.lock_dir is None:
+            yield
+            return
+
+        import fcntl  # pylint: disable=import-outside-toplevel
+        while True:
+            for index in range(self.max_concurrency):
+                f = open(self.lock_path(f'slot{index}'), 'a', encoding='ascii')
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    f.close()
+                    continue
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+                    f.close()
+                return
+            time.sleep(LOCK_POLL_INTERVAL)
+
+
+_schedulers: dict[str, HostScheduler] = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(host: str, **kwargs: Any) -> HostScheduler:
+    """Get the process-wide scheduler of the host, creating it on first use."""
+    with _schedulers_lock:
+        if host not in _schedulers:
+            _schedulers[host] = HostScheduler(host, **kwargs)
+        return _schedulers[host]
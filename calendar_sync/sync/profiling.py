@@ -0,0 +1,123 @@
+"""
+Opt-in CPU and memory profiling of syncs.
+
+A profiled sync runs under cProfile and between two tracemalloc snapshots, and the report
+stored in `SyncMetrics.profile` lists
+- the functions with the most own CPU time,
+- the allocation sites holding the most memory when the sync returns, before the garbage
+  collector runs, e.g. parse trees kept alive by reference cycles, and
+- the allocation sites still holding memory after a full collection, i.e. what the sync
+  leaves behind in a long-running worker.
+
+Both profilers are process-wide, so only one sync is profiled at a time and allocations of
+other threads running meanwhile are included.
+"""
+from __future__ import annotations
+
+import contextlib
+import cProfile
+import gc
+import os
+import pstats
+import threading
+import tracemalloc
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+
+    from .metrics import SyncMetrics
+
+# number of entries kept in each list of the report
+TOP_ENTRIES = 20
+# number of frames stored per allocation, more is slower but shows where it came from
+TRACEBACK_LIMIT = 1
+
+TRACE_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    tracemalloc.Filter(False, '<unknown>'),
+]
+
+_profile_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def profile(metrics: SyncMetrics) -> Iterator[None]:
+    """
+    Profile the sync in the block and store the report in `metrics.profile`, also if it
+    fails. Does nothing if another sync of the process is being profiled.
+    """
+    if not _profile_lock.acquire(blocking=False):
+        yield
+        return
+
+    was_tracing = tracemalloc.is_tracing()
+    if not was_tracing:
+        tracemalloc.start(TRACEBACK_LIMIT)
+    tracemalloc.reset_peak()
+    before = tracemalloc.take_snapshot().filter_traces(TRACE_FILTERS)
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            traced, peak = tracemalloc.get_traced_memory()
+            returned = tracemalloc.take_snapshot().filter_traces(TRACE_FILTERS)
+            gc.collect()
+            retained = tracemalloc.take_snapshot().filter_traces(TRACE_FILTERS)
+            metrics.profile = {
+                'hot_functions': hot_functions(profiler),
+                'top_allocations': allocation_sites(returned, before),
+                'retained_allocations': allocation_sites(retained, before),
+                'retained_bytes': sum(stat.size_diff for stat in retained.compare_to(
+                    before, 'filename')),
+                'peak_traced_bytes': peak,
+                'traced_bytes': traced,
+            }
+    finally:
+        if not was_tracing:
+            tracemalloc.stop()
+        _profile_lock.release()
+
+
+def hot_functions(profiler: cProfile.Profile) -> list[dict[str, Any]]:
+    """List the functions with the most own time."""
+    stats = pstats.Stats(profiler).stats  # pylint: disable=no-member
+    entries = sorted(stats.items(), key=lambda item: item[1][2], reverse=True)
+    return [
+        {
+            'function': f'{shorten(filename)}:{lineno}({name})',
+            'calls': calls,
+            'own_time': own_time,
+            'cumulative_time': cumulative_time,
+        }
+        for (filename, lineno, name), (_, calls, own_time, cumulative_time, _)
+        in entries[:TOP_ENTRIES]
+    ]
+
+
+def allocation_sites(snapshot: tracemalloc.Snapshot,
+                     before: tracemalloc.Snapshot) -> list[dict[str, Any]]:
+    """List the lines that allocated the most memory still held in `snapshot`."""
+    stats = [stat for stat in snapshot.compare_to(before, 'lineno') if stat.size_diff > 0]
+    return [
+        {
+            'location': f'{shorten(stat.traceback[0].filename)}:{stat.traceback[0].lineno}',
+            'bytes': stat.size_diff,
+            'blocks': stat.count_diff,
+        }
+        for stat in stats[:TOP_ENTRIES]
+    ]
+
+
+def shorten(filename: str) -> str:
+    """Shorten a path to start at its package, e.g. at site-packages or the project."""
+    for marker in ('site-packages' + os.sep, 'dist-packages' + os.sep):
+        if marker in filename:
+            return filename.split(marker, 1)[1]
+    cwd = os.getcwd() + os.sep
+    return filename[len(cwd):] if filename.startswith(cwd) else filename
@@ -0,0 +1,75 @@
+"""Typed records passed through the sync pipeline."""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Any
+
+# version of the parsing of assignment pages, part of the month view fingerprints so that
+# bumping it makes every cached assignment be fetched and parsed again, e.g. 2 for the
+# normalized descriptions of `calendar_sync.sync.description` and 3 for the due times of the
+# month view
+PARSE_VERSION = 3
+
+
+@dataclass(slots=True)
+class Assignment:
+    """An assignment crawled from Moodle."""
+    title: str
+    deadline: str
+    description: str
+    can_submit: bool
+    submission_status: str
+    url: str = ''
+    # fingerprint of the month view entry and Unix time when the page was fetched
+    fingerprint: str = ''
+    fetched_at: float = 0.0
+
+
+@dataclass(slots=True)
+class MonthEvent:
+    """An assignment as listed in the month view, before its page is fetched."""
+    url: str
+    event_id: str
+    name: str
+    # Unix time of the due time, or of the day if the entry shows no time
+    timestamp: str
+    course_id: str
+
+    @property
+    def fingerprint(self) -> str:
+        """
+        Identifies what the month view shows, changing when the entry is edited or when the
+        parsing of the pages changes, see `PARSE_VERSION`.
+        """
+        return '|'.join([
+            f'v{PARSE_VERSION}', self.event_id, self.name, self.timestamp, self.course_id])
+
+
+@dataclass(slots=True)
+class CalendarEvent:
+    """An event of a calendar, keeping only the fields the sync compares."""
+    id: str
+    summary: str
+    description: str
+    start: str | None
+    end: str | None
+    color_id: str
+
+    @classmethod
+    def from_api(cls, item: dict[str, Any]) -> CalendarEvent:
+        """Create a record from an event resource returned by Google Calendar API."""
+        return cls(
+            id=item['id'],
+            summary=item.get('summary', ''),
+            description=item.get('description', ''),
+            start=item.get('start', {}).get('dateTime'),
+            end=item.get('end', {}).get('dateTime'),
+            color_id=str(item.get('colorId', '')),
+        )
+
+
+@dataclass(frozen=True, slots=True)
+class SyncTargets:
+    """Courses and assignment pages a targeted sync is limited to."""
+    course_ids: tuple[int, ...] = ()
+    assign_urls: tuple[str, ...] = ()
@@ -0,0 +1,78 @@
+"""
+Pooled HTTP transport for the Google API client.
+
+The discovery client talks through httplib2 by default, which is not thread-safe and opens
+new TLS connections for every client. `PooledHttp` instead sends the client's requests
+through an `AuthorizedSession` (refreshing the user's credentials as needed) mounted on
+one connection pool shared by all clients of the process, so concurrent syncs reuse warm
+keep-alive connections to googleapis.com.
+"""
+from __future__ import annotations
+
+import threading
+from typing import TYPE_CHECKING, Any
+
+import httplib2
+from google.auth.transport.requests import AuthorizedSession
+from requests.adapters import HTTPAdapter
+
+if TYPE_CHECKING:
+    from google.oauth2.credentials import Credentials
+
+# seconds to wait for the connection and for each read
+DEFAULT_TIMEOUT = 30.0
+# number of hosts to keep pools for and number of connections kept per host
+DEFAULT_POOL_CONNECTIONS = 4
+DEFAULT_POOL_MAXSIZE = 32
+
+_adapter: HTTPAdapter | None = None
+_adapter_lock = threading.Lock()
+
+
+def get_adapter(pool_connections: int = DEFAULT_POOL_CONNECTIONS,
+                pool_maxsize: int = DEFAULT_POOL_MAXSIZE) -> HTTPAdapter:
+    """Get the process-wide connection pool, creating it with the given sizes on first use."""
+    global _adapter  # pylint: disable=global-statement
+    with _adapter_lock:
+        if _adapter is None:
+            # don't block when the pool is exhausted, extra connections are just not kept
+            _adapter = HTTPAdapter(pool_connections=pool_connections,
+                                   pool_maxsize=pool_maxsize, pool_block=False)
+        return _adapter
+
+
+class PooledHttp:
+    """
+    httplib2-compatible object for `googleapiclient.discovery.build(http=...)` sending
+    authorized requests through the shared connection pool.
+    """
+
+    def __init__(self, credentials: Credentials, timeout: float = DEFAULT_TIMEOUT,
+                 adapter: HTTPAdapter | None = None) -> None:
+        self.credentials = credentials
+        self.timeout = timeout
+        self.session = AuthorizedSession(credentials)
+        adapter = adapter or get_adapter()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def request(self, uri: str, method: str = 'GET', body: Any = None,
+                headers: dict[str, str] | None = None, redirections: int = 5,
+                connection_type: Any = None) -> tuple[httplib2.Response, bytes]:
+        """Send a request like `httplib2.Http.request`."""
+        # pylint: disable=unused-argument
+        response = self.session.request(method, uri, data=body, headers=headers,
+                                        timeout=self.timeout)
+        info = {name.lower(): value for name, value in response.headers.items()}
+        # the body is already decoded, like httplib2 does
+        info.pop('content-encoding', None)
+        info['status'] = str(response.status_code)
+        resp = httplib2.Response(info)
+        resp.reason = response.reason
+        return resp, response.content
+
+    def close(self) -> None:
+        """Close the session, leaving the shared pool open."""
+        # the adapters are shared, so don't let `Session.close` close them
+        self.session.adapters.clear()
+        self.session.close()
@@ -1,13 +1,23 @@
 """Utility functions for calendar sync."""
 from __future__ import annotations
 
+import dataclasses
 import datetime
+import json
+import os
 import re
-from typing import Any
+import urllib.parse
+from typing import TYPE_CHECKING, Any
 
 from dateutil.relativedelta import relativedelta
 
 from calendar_sync.sync.exceptions import SubmissionStatusError
+from calendar_sync.sync.records import Assignment
+
+if TYPE_CHECKING:
+    from pathlib import Path
+
+    from calendar_sync.sync.records import CalendarEvent
 
 
 def get_next_k_month_timestamp(k: int) -> list[int]:
@@ -33,6 +43,21 @@ def parse_date(date_str: str) -> str:
                   date_str) + ":00"
 
 
+def parse_deadline(deadline: str) -> datetime.datetime:
+    """Parse a deadline produced by `parse_date` into an aware datetime in UTC+8."""
+    return datetime.datetime.strptime(deadline, '%Y-%m-%dT%H:%M:%S').replace(
+        tzinfo=datetime.timezone(datetime.timedelta(hours=8)))
+
+
+def is_valid_deadline(deadline: str) -> bool:
+    """Check if the deadline can be parsed by `parse_deadline`."""
+    try:
+        parse_deadline(deadline)
+    except ValueError:
+        return False
+    return True
+
+
 def get_cal_id(calendars: list[dict[str, Any]], summary: str) -> str | None:
     """Get the ID of the calendar with the given summary."""
     for cal in calendars:
@@ -49,8 +74,19 @@ def get_iso_format_date(
     return date.isoformat() + '+08:00'
 
 
-def get_color_id(can_submit: bool, submission_status: str) -> int:
+def get_assign_id(assign_url: str) -> str:
+    """Get the ID of an assignment from the URL of its page."""
+    parts = urllib.parse.urlsplit(assign_url)
+    ids = urllib.parse.parse_qs(parts.query).get('id', [])
+    if not parts.path.endswith('/mod/assign/view.php') or len(ids) != 1 or not ids[0].isdigit():
+        raise ValueError(f'`{assign_url}` is not the URL of an assignment.')
+    return ids[0]
+
+
+def get_color_id(assign: Assignment) -> int:
     """Get the color ID of the event based on the submission status."""
+    can_submit = assign.can_submit
+    submission_status = assign.submission_status
     if not can_submit or not submission_status or submission_status == 'unknown':
         return 8    # gray
     elif submission_status == 'not_submitted':
@@ -61,16 +97,30 @@ def get_color_id(can_submit: bool, submission_status: str) -> int:
         raise SubmissionStatusError(f'Unexpected submission status: {submission_status}')
 
 
-def event_identical(event: dict[str, Any], assign: dict[str, Any]) -> bool:
+def event_identical(event: CalendarEvent, assign: Assignment) -> bool:
     """Check if two events are identical."""
-    if event['summary'] != assign['title']:
+    if event.summary != assign.title:
         return False
-    if event['description'] != assign['description']:
+    if event.description != assign.description:
         return False
-    if event['start']['dateTime'] != assign['deadline']:
+    if event.start != assign.deadline:
         return False
-    if event['end']['dateTime'] != assign['deadline']:
+    if event.end != assign.deadline:
         return False
-    if event['colorId'] != str(get_color_id(assign['can_submit'], assign['submission_status'])):
+    if event.color_id != str(get_color_id(assign)):
         return False
     return True
+
+
+def load_assignments(path: Path | str) -> dict[str, Assignment]:
+    """Load the assignments saved by `save_assignments`, keyed by URL."""
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return {item['url']: Assignment(**item) for item in json.load(f)}
+
+
+def save_assignments(path: Path | str, assignments: list[Assignment]) -> None:
+    """Save the assignments to a JSON file."""
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump([dataclasses.asdict(assign) for assign in assignments], f, ensure_ascii=False)
@@ -1,3 +1,596 @@
-from django.test import TestCase
+"""Tests of the deterministic and race-prone parts of the calendar_sync app."""
+import asyncio
+import datetime
+import html.parser
+import json
+import os
+import re
+import tempfile
+import threading
+from unittest import mock
 
-# Create your tests here.
+import bs4
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from . import coalescing, feeds, jobs, progress, scheduling, views
+from .models import SyncRun, SyncSchedule
+from .sync import circuit
+from .sync import config as sync_config
+from .sync.crawler import MoodleCrawler, get_event_timestamp, needs_fetch
+from .sync.description import MORE_LINK_TEXT, normalize_description
+from .sync.exceptions import CircuitOpenException, LoginFailedException
+from .sync.main import get_session_cache_path
+from .sync.records import Assignment, MonthEvent
+from .sync.utils import is_valid_deadline, parse_date, parse_deadline
+
+ASSIGN_URL = 'https://moodle.ncku.edu.tw/mod/assign/view.php?id=5'
+
+
+class CoalesceTests(SimpleTestCase):
+    """Tests of `coalescing.coalesce`."""
+
+    def setUp(self):
+        # results of earlier tests must not be debounced into this one
+        coalescing._recent.clear()  # pylint: disable=protected-access
+
+    def test_concurrent_triggers_join_the_sync_in_flight(self):
+        started = threading.Event()
+        release = threading.Event()
+        joined = threading.Semaphore(0)
+        calls = []
+
+        def run():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return {'created': 1}
+
+        original_wait = coalescing.Flight.wait
+
+        def wait(flight):
+            joined.release()
+            return original_wait(flight)
+
+        results = []
+        with mock.patch.object(coalescing.Flight, 'wait', wait):
+            leader = threading.Thread(target=lambda: results.append(coalescing.coalesce(1, run)))
+            leader.start()
+            # the flight is registered before `run` is called
+            self.assertTrue(started.wait(5))
+            followers = [
+                threading.Thread(target=lambda: results.append(coalescing.coalesce(1, run)))
+                for _ in range(4)]
+            for follower in followers:
+                follower.start()
+            for _ in followers:
+                self.assertTrue(joined.acquire(timeout=5))
+            release.set()
+            for thread in [leader, *followers]:
+                thread.join(5)
+                self.assertFalse(thread.is_alive())
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{'created': 1}] * 5)
+
+    def test_triggers_after_the_sync_are_debounced(self):
+        run = mock.Mock(return_value={'created': 1})
+        first = coalescing.coalesce(2, run)
+        self.assertIs(coalescing.coalesce(2, run), first)
+        self.assertEqual(run.call_count, 1)
+
+    def test_debounce_can_be_skipped(self):
+        run = mock.Mock(return_value={'created': 1})
+        coalescing.coalesce(3, run)
+        coalescing.coalesce(3, run, debounce=False)
+        self.assertEqual(run.call_count, 2)
+
+    def test_debounce_expires(self):
+        run = mock.Mock(return_value={'created': 1})
+        coalescing.coalesce(4, run)
+        later = coalescing.time.monotonic() + coalescing.DEBOUNCE_WINDOW.total_seconds()
+        with mock.patch.object(coalescing.time, 'monotonic', return_value=later):
+            coalescing.coalesce(4, run)
+        self.assertEqual(run.call_count, 2)
+
+    def test_failures_are_not_debounced(self):
+        run = mock.Mock(side_effect=[ValueError('down'), {'created': 1}])
+        with self.assertRaises(ValueError):
+            coalescing.coalesce(5, run)
+        self.assertEqual(coalescing.coalesce(5, run), {'created': 1})
+
+    def test_keys_are_independent(self):
+        run = mock.Mock(return_value={'created': 1})
+        coalescing.coalesce(6, run)
+        coalescing.coalesce((6, 'targets'), run)
+        self.assertEqual(run.call_count, 2)
+
+
+class ProgressStreamTests(SimpleTestCase):
+    """Tests of `progress.stream`."""
+
+    result = {'assignments': [], 'created': 0, 'updated': 0}
+
+    async def test_stream_gets_only_the_events_of_its_key(self):
+        async def run_sync():
+            progress.publish((1, 'targets'), 'phase', {'phase': 'crawl'})
+            progress.publish(1, 'phase', {'phase': 'login'})
+            return self.result
+
+        events = [event async for event in progress.stream(1, run_sync)]
+        self.assertEqual(events, [
+            progress.format_event('phase', {'phase': 'login'}),
+            progress.format_event('done', {'assignments': 0, 'created': 0, 'updated': 0}),
+        ])
+
+    async def test_dropped_stream_cancels_its_read(self):
+        release = asyncio.Event()
+
+        async def run_sync():
+            await release.wait()
+            return self.result
+
+        read = asyncio.ensure_future(anext(progress.stream(2, run_sync)))
+        await asyncio.sleep(0.01)
+        read.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await read
+        await asyncio.sleep(0)
+        pending = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        self.assertEqual([task.get_coro().__qualname__ for task in pending],
+                         ['ProgressStreamTests.test_dropped_stream_cancels_its_read.<locals>'
+                          '.run_sync'])
+        self.assertNotIn(2, progress._subscriptions)  # pylint: disable=protected-access
+        release.set()
+        await pending[0]
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    """Tests of the state transitions of `circuit.CircuitBreaker`."""
+
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch.object(circuit.time, 'monotonic', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = circuit.CircuitBreaker(
+            'test', is_failure=lambda e: isinstance(e, ConnectionError),
+            min_calls=4, failure_threshold=0.5, open_duration=60.0)
+
+    def fail(self):
+        with self.assertRaises(ConnectionError):
+            self.breaker.call(mock.Mock(side_effect=ConnectionError))
+
+    def trip(self):
+        for _ in range(4):
+            self.fail()
+
+    def test_stays_closed_below_min_calls(self):
+        for _ in range(3):
+            self.fail()
+        self.assertEqual(self.breaker.state, circuit.CLOSED)
+
+    def test_stays_closed_below_failure_threshold(self):
+        self.fail()
+        for _ in range(3):
+            self.breaker.call(mock.Mock())
+        self.assertEqual(self.breaker.state, circuit.CLOSED)
+
+    def test_errors_that_are_not_failures_are_ignored(self):
+        for _ in range(4):
+            with self.assertRaises(ValueError):
+                self.breaker.call(mock.Mock(side_effect=ValueError))
+        self.assertEqual(self.breaker.state, circuit.CLOSED)
+
+    def test_opens_and_rejects_calls(self):
+        self.trip()
+        self.assertEqual(self.breaker.state, circuit.OPEN)
+        func = mock.Mock()
+        with self.assertRaises(CircuitOpenException) as cm:
+            self.breaker.call(func)
+        func.assert_not_called()
+        self.assertEqual(cm.exception.retry_after, 60.0)
+        with self.assertRaises(CircuitOpenException):
+            self.breaker.check()
+
+    def test_half_open_lets_one_probe_through(self):
+        self.trip()
+        self.now += 60
+        self.breaker.check()
+        self.breaker.allow()
+        self.assertEqual(self.breaker.state, circuit.HALF_OPEN)
+        with self.assertRaises(CircuitOpenException):
+            self.breaker.check()
+        with self.assertRaises(CircuitOpenException):
+            self.breaker.allow()
+
+    def test_healthy_probe_closes(self):
+        self.trip()
+        self.now += 60
+        self.breaker.call(mock.Mock())
+        self.assertEqual(self.breaker.state, circuit.CLOSED)
+        self.breaker.call(mock.Mock())
+
+    def test_failed_probe_reopens(self):
+        self.trip()
+        self.now += 60
+        self.fail()
+        self.assertEqual(self.breaker.state, circuit.OPEN)
+        self.assertEqual(self.breaker.retry_after(), 60.0)
+
+    def test_slow_probe_reopens(self):
+        self.trip()
+        self.now += 60
+
+        def slow():
+            self.now += self.breaker.slow_call_duration
+
+        self.breaker.call(slow)
+        self.assertEqual(self.breaker.state, circuit.OPEN)
+
+    def test_calls_admitted_before_the_trip_are_not_probes(self):
+        stale = self.breaker.allow()
+        self.trip()
+        self.now += 60
+        probe = self.breaker.allow()
+        self.breaker.record(False, 0.0, stale)
+        self.assertEqual(self.breaker.state, circuit.HALF_OPEN)
+        self.breaker.record(True, 0.0, probe)
+        self.assertEqual(self.breaker.state, circuit.OPEN)
+
+    def test_probes_finishing_after_the_close_are_ignored(self):
+        self.breaker.half_open_calls = 2
+        self.trip()
+        self.now += 60
+        first = self.breaker.allow()
+        second = self.breaker.allow()
+        self.breaker.record(False, 0.0, first)
+        self.assertEqual(self.breaker.state, circuit.CLOSED)
+        self.breaker.record(True, 0.0, second)
+        self.assertEqual(self.breaker.state, circuit.CLOSED)
+        self.assertFalse(self.breaker.calls)
+
+
+class LeaseTests(TestCase):
+    """Tests of the lease exclusion of `jobs.claim` and `jobs.claim_user`."""
+
+    def make_due(self, user_id):
+        return SyncSchedule.objects.create(
+            user_id=user_id, moodle_session_id='session',
+            next_sync_at=timezone.now() - datetime.timedelta(minutes=user_id))
+
+    def test_claim_user_excludes_other_workers(self):
+        schedule = jobs.claim_user(1, 'a')
+        self.assertIsNotNone(schedule)
+        self.assertIsNone(jobs.claim_user(1, 'b'))
+        jobs.release(schedule, 'a')
+        self.assertIsNotNone(jobs.claim_user(1, 'b'))
+
+    def test_release_by_another_worker_keeps_the_lease(self):
+        schedule = jobs.claim_user(1, 'a')
+        jobs.release(schedule, 'b')
+        self.assertIsNone(jobs.claim_user(1, 'b'))
+
+    def test_expired_lease_can_be_claimed(self):
+        schedule = jobs.claim_user(1, 'a')
+        SyncSchedule.objects.filter(pk=schedule.pk).update(
+            lease_expires_at=timezone.now() - datetime.timedelta(seconds=1))
+        self.assertIsNotNone(jobs.claim_user(1, 'b'))
+        self.assertFalse(jobs.heartbeat(schedule, 'a'))
+
+    def test_claim_skips_leased_jobs(self):
+        for user_id in (1, 2, 3):
+            self.make_due(user_id)
+        first = jobs.claim('a', limit=1)
+        rest = jobs.claim('b', limit=5)
+        self.assertEqual([schedule.user_id for schedule in first], [3])
+        self.assertEqual(sorted(schedule.user_id for schedule in rest), [1, 2])
+        self.assertEqual(jobs.claim('c', limit=5), [])
+
+    def test_claim_skips_users_claimed_for_a_manual_sync(self):
+        self.make_due(1)
+        jobs.claim_user(1, 'a')
+        self.assertEqual(jobs.claim('b', limit=5), [])
+
+    def test_wait_and_claim_user_times_out(self):
+        jobs.claim_user(1, 'a')
+        with self.assertRaises(TimeoutError):
+            jobs.wait_and_claim_user(1, 'b', timeout=datetime.timedelta(0))
+
+
+class NextSyncIntervalTests(SimpleTestCase):
+    """Tests of `scheduling.next_sync_interval`."""
+
+    now = datetime.datetime(2026, 10, 1, 12, tzinfo=datetime.timezone.utc)
+
+    def interval(self, until_deadline=None, change_rate=0.0, inactive_for=None):
+        deadline = self.now + until_deadline if until_deadline is not None else None
+        last_active_at = self.now - inactive_for if inactive_for is not None else None
+        return scheduling.next_sync_interval(self.now, deadline, change_rate, last_active_at)
+
+    def test_closer_deadlines_sync_more_often(self):
+        self.assertEqual(self.interval(datetime.timedelta(hours=3)),
+                         datetime.timedelta(minutes=15))
+        self.assertEqual(self.interval(datetime.timedelta(hours=12)),
+                         datetime.timedelta(minutes=30))
+        self.assertEqual(self.interval(datetime.timedelta(days=2)), datetime.timedelta(hours=2))
+        self.assertEqual(self.interval(datetime.timedelta(days=5)), datetime.timedelta(hours=6))
+        self.assertEqual(self.interval(datetime.timedelta(days=30)),
+                         scheduling.NO_DEADLINE_INTERVAL)
+
+    def test_past_deadlines_are_ignored(self):
+        self.assertEqual(self.interval(-datetime.timedelta(hours=1)),
+                         scheduling.NO_DEADLINE_INTERVAL)
+
+    def test_changes_shorten_the_interval(self):
+        self.assertEqual(self.interval(change_rate=1.0), scheduling.NO_DEADLINE_INTERVAL / 2)
+
+    def test_inactivity_lengthens_the_interval(self):
+        self.assertEqual(self.interval(datetime.timedelta(days=5), inactive_for=datetime.timedelta(
+            days=20)), datetime.timedelta(hours=24))
+        self.assertEqual(self.interval(datetime.timedelta(days=2), inactive_for=datetime.timedelta(
+            days=20)), datetime.timedelta(hours=8))
+
+    def test_inactivity_does_not_delay_urgent_deadlines(self):
+        self.assertEqual(self.interval(datetime.timedelta(hours=3), inactive_for=datetime.timedelta(
+            days=90)), datetime.timedelta(minutes=15))
+
+    def test_interval_is_clamped(self):
+        self.assertEqual(self.interval(datetime.timedelta(hours=1), change_rate=100.0),
+                         scheduling.MIN_SYNC_INTERVAL)
+        self.assertEqual(self.interval(inactive_for=datetime.timedelta(days=90)),
+                         scheduling.MAX_SYNC_INTERVAL)
+
+
+class NeedsFetchTests(SimpleTestCase):
+    """Tests of `crawler.needs_fetch`."""
+
+    deadline = '2026-10-1T23:59:00'
+    event = MonthEvent(url=ASSIGN_URL, event_id='1', name='HW1', timestamp='1759334340',
+                       course_id='2')
+
+    def assignment(self, status='not_submitted', fingerprint=None, fetched_at=0.0):
+        return Assignment(
+            title='HW1', deadline=self.deadline, description='', can_submit=True,
+            submission_status=status, url=ASSIGN_URL,
+            fingerprint=self.event.fingerprint if fingerprint is None else fingerprint,
+            fetched_at=fetched_at)
+
+    def test_unchanged_page_far_from_deadline_is_not_fetched(self):
+        now = parse_deadline(self.deadline).timestamp() - 10 * 24 * 60 * 60
+        self.assertFalse(needs_fetch(self.assignment(fetched_at=now - 60), self.event, now))
+
+    def test_edited_entry_is_fetched(self):
+        now = parse_deadline(self.deadline).timestamp() - 10 * 24 * 60 * 60
+        assign = self.assignment(fingerprint='old', fetched_at=now - 60)
+        self.assertTrue(needs_fetch(assign, self.event, now))
+
+    def test_old_page_is_fetched(self):
+        now = parse_deadline(self.deadline).timestamp() - 10 * 24 * 60 * 60
+        assign = self.assignment(fetched_at=now - 2 * 24 * 60 * 60)
+        self.assertTrue(needs_fetch(assign, self.event, now))
+
+    def test_status_is_refreshed_close_to_the_deadline(self):
+        now = parse_deadline(self.deadline).timestamp() - 60 * 60
+        self.assertTrue(needs_fetch(self.assignment(fetched_at=now - 60), self.event, now))
+
+    def test_submitted_assignment_is_not_refreshed(self):
+        now = parse_deadline(self.deadline).timestamp() - 60 * 60
+        assign = self.assignment(status='submitted', fetched_at=now - 60)
+        self.assertFalse(needs_fetch(assign, self.event, now))
+
+
+class DeadlineTests(SimpleTestCase):
+    """Tests of `utils.is_valid_deadline`."""
+
+    def test_parsed_deadline_is_valid(self):
+        self.assertTrue(is_valid_deadline(parse_date('2026年 10月 1日(星期四) 23:59')))
+
+    def test_unparsed_deadline_is_invalid(self):
+        self.assertFalse(is_valid_deadline(parse_date('2026年 10月 1日')))
+        self.assertFalse(is_valid_deadline(''))
+
+
+class SessionCacheTests(SimpleTestCase):
+    """Tests of the Moodle session cache of the standalone sync."""
+
+    def test_default_path_is_per_account(self):
+        config = sync_config.load_config()
+        first = get_session_cache_path({**config, 'moodle_cred_path': 'a.json'})
+        second = get_session_cache_path({**config, 'moodle_cred_path': 'b.json'})
+        self.assertNotEqual(first, second)
+        self.assertTrue(first.startswith(sync_config.APP_DATA_DIR))
+
+    def test_failed_login_is_not_cached(self):
+        def respond(method, url, **kwargs):
+            if method == 'HEAD':
+                return mock.Mock(is_redirect=True, headers={'Location': '/login/index.php'})
+            return mock.Mock(text='<input name="logintoken" value="token">')
+
+        with tempfile.TemporaryDirectory() as directory:
+            cred_path = os.path.join(directory, 'credentials.json')
+            with open(cred_path, 'w', encoding='utf-8') as f:
+                json.dump({'username': 'user', 'password': 'wrong'}, f)
+            cache_path = os.path.join(directory, 'session.json')
+            with mock.patch.object(MoodleCrawler, 'request', side_effect=respond), \
+                    self.assertRaises(LoginFailedException):
+                MoodleCrawler(login_cred_path=cred_path, session_cache_path=cache_path)
+            self.assertFalse(os.path.exists(cache_path))
+
+
+class EventTimestampTests(SimpleTestCase):
+    """Tests of `crawler.get_event_timestamp`."""
+
+    def cell(self, entry):
+        soup = bs4.BeautifulSoup(
+            f'<td data-day-timestamp="1759248000"><ul><li data-region="event-item">{entry}'
+            '<a data-action="view-event" href="#">HW1</a></li></ul></td>', 'html.parser')
+        return soup.td, soup.li
+
+    def test_time_of_day_is_added(self):
+        self.assertEqual(get_event_timestamp(*self.cell('<span>23:59</span>')), '1759334340')
+
+    def test_day_is_used_without_a_time(self):
+        self.assertEqual(get_event_timestamp(*self.cell('')), '1759248000')
+
+    def test_moving_the_due_time_changes_the_fingerprint(self):
+        events = [MonthEvent(ASSIGN_URL, '1', 'HW1', get_event_timestamp(*self.cell(time)), '2')
+                  for time in ('<span>12:00</span>', '<span>23:59</span>')]
+        self.assertNotEqual(events[0].fingerprint, events[1].fingerprint)
+
+
+class TagBalance(html.parser.HTMLParser):
+    """Collects the errors in the nesting of the tags of a document."""
+
+    def __init__(self):
+        super().__init__()
+        self.stack = []
+        self.errors = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag != 'br':
+            self.stack.append(tag)
+
+    def handle_endtag(self, tag):
+        if not self.stack or self.stack.pop() != tag:
+            self.errors.append(tag)
+
+
+class NormalizeDescriptionTests(SimpleTestCase):
+    """Tests of `description.normalize_description`."""
+
+    def normalize(self, markup, max_length=None):
+        intro = bs4.BeautifulSoup(f'<div id="intro">{markup}</div>', 'html.parser').div
+        return normalize_description(intro, ASSIGN_URL, max_length)
+
+    def assert_balanced(self, description):
+        parser = TagBalance()
+        parser.feed(description)
+        self.assertEqual(parser.errors, [])
+        self.assertEqual(parser.stack, [])
+
+    def test_missing_intro(self):
+        self.assertEqual(normalize_description(None, ASSIGN_URL), '')
+
+    def test_keeps_only_supported_markup(self):
+        description = self.normalize(
+            '<div class="no-overflow"><p style="color: red">  Submit   <strong>report</strong>'
+            ' &amp; code.</p><p><br></p><script>alert(1)</script><!-- note -->'
+            '<ul><li> one </li><li>two</li></ul><img src="x.png"></div>')
+        self.assertEqual(description, 'Submit <b>report</b> &amp; code.'
+                                      '<ul><li>one</li><li>two</li></ul>')
+
+    def test_links_are_resolved_against_the_assignment(self):
+        description = self.normalize(
+            '<a href="/pluginfile.php/1/spec.pdf" target="_blank">spec</a> '
+            '<a href="javascript:alert(1)">bad</a>')
+        self.assertEqual(description,
+                         '<a href="https://moodle.ncku.edu.tw/pluginfile.php/1/spec.pdf">spec</a>'
+                         ' bad')
+
+    def test_short_description_is_not_cut(self):
+        self.assertEqual(self.normalize('<p>HW1</p>', max_length=100), 'HW1')
+
+    def test_long_description_is_cut_with_balanced_tags(self):
+        markup = ('<p><b>' + '繳交報告 ' * 200 + '<i>' + 'x ' * 200 + '</i></b></p>') * 3
+        for max_length in (120, 200, 333, 1000, 2000):
+            description = self.normalize(markup, max_length)
+            self.assertLessEqual(len(description), max_length)
+            self.assertIn('…', description)
+            self.assertTrue(description.endswith(f'<a href="{ASSIGN_URL}">{MORE_LINK_TEXT}</a>'))
+            self.assert_balanced(description)
+
+    def test_cut_inside_nested_list_is_balanced(self):
+        markup = '<ul>' + '<li><a href="/a">item <b>bold</b></a></li>' * 50 + '</ul>'
+        for max_length in range(120, 400, 7):
+            description = self.normalize(markup, max_length)
+            self.assertLessEqual(len(description), max_length)
+            self.assert_balanced(description)
+
+    def test_cut_never_splits_entities(self):
+        description = self.normalize('&amp;' * 100, max_length=130)
+        self.assertNotRegex(description.split('…')[0], r'&(?!amp;)')
+
+    def test_limit_below_the_link_leaves_only_the_link(self):
+        self.assertEqual(self.normalize('<p>' + 'x' * 100 + '</p>', max_length=10),
+                         f'<a href="{ASSIGN_URL}">{MORE_LINK_TEXT}</a>')
+
+    def test_output_is_deterministic(self):
+        markup = '<p>Due <em>soon</em></p>' * 100
+        self.assertEqual(self.normalize(markup, 500), self.normalize(markup, 500))
+
+
+class FeedTests(TestCase):
+    """Tests of the iCalendar feeds of `feeds` and their views."""
+
+    def assignment(self, assign_id, title='HW', deadline='2026-10-1T23:59:00'):
+        return Assignment(
+            title=title, deadline=deadline, description='<p>Upload a PDF.</p>',
+            can_submit=True, submission_status='not_submitted',
+            url=f'https://moodle.ncku.edu.tw/mod/assign/view.php?id={assign_id}')
+
+    def get_feed(self, token, etag=None):
+        headers = {'If-None-Match': etag} if etag else {}
+        return self.client.get(reverse('feed', args=[token]), headers=headers)
+
+    def test_invalid_token_is_not_found(self):
+        feeds.store_assignments(1, [self.assignment(1)])
+        token = feeds.make_feed_token(1)
+        self.assertEqual(self.get_feed(token).status_code, 200)
+        self.assertEqual(self.get_feed(token.replace('1:', '2:', 1)).status_code, 404)
+        self.assertEqual(self.get_feed('1').status_code, 404)
+
+    def test_unchanged_feed_is_not_modified(self):
+        feeds.store_assignments(1, [self.assignment(1)])
+        token = feeds.make_feed_token(1)
+        response = self.get_feed(token)
+        self.assertIn('SUMMARY:HW', response.content.decode())
+        etag = response['ETag']
+        self.assertEqual(self.get_feed(token, etag).status_code, 304)
+
+        feeds.store_assignments(1, [self.assignment(1, title='HW1')])
+        response = self.get_feed(token, etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('SUMMARY:HW1', response.content.decode())
+
+    def test_storing_unchanged_assignments_keeps_the_etag(self):
+        feeds.store_assignments(1, [self.assignment(1)])
+        etag = feeds.get_feed_etag(1)
+        feeds.store_assignments(1, [self.assignment(1)])
+        self.assertEqual(feeds.get_feed_etag(1), etag)
+
+    def test_long_lines_are_folded(self):
+        vevent = feeds.render_vevent(self.assignment(1, title='作業' * 60), timezone.now())
+        lines = vevent.split('\r\n')
+        self.assertTrue(all(len(line.encode('utf-8')) <= 75 for line in lines))
+        unfolded = re.sub(r'\r\n ', '', vevent)
+        self.assertIn(f'SUMMARY:{"作業" * 60}\r\n', unfolded)
+
+    def test_assignments_not_crawled_are_pruned(self):
+        feeds.store_assignments(1, [self.assignment(1), self.assignment(2)])
+        feeds.store_assignments(1, [self.assignment(1)], prune=False)
+        self.assertEqual(len(feeds.load_assignments(1)), 2)
+        feeds.store_assignments(1, [self.assignment(1)])
+        self.assertEqual(list(feeds.load_assignments(1)), [self.assignment(1).url])
+
+    def test_feed_url_needs_no_google_account(self):
+        url = reverse('feed_url')
+        headers = {'Moodle-Session': 'session', 'Moodle-ID': '7'}
+        with mock.patch.object(views, 'session_user_id', return_value='8'):
+            self.assertEqual(self.client.get(url, headers=headers).status_code, 403)
+        with mock.patch.object(views, 'session_user_id', return_value='7'):
+            response = self.client.get(url, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content.decode().endswith(
+            reverse('feed', args=[feeds.make_feed_token(7)])))
+        # the scheduler keeps the feed up to date with the session
+        self.assertEqual(SyncSchedule.objects.get(user_id=7).moodle_session_id, 'session')
+
+    def test_users_without_google_account_are_only_crawled(self):
+        result = {'assignments': [self.assignment(1)], 'created': 0, 'updated': 0,
+                  'metrics': None}
+        with mock.patch.object(views.sync.main, 'sync', return_value=result) as sync_mock:
+            views.sync_user(7, 'session', SyncRun.BACKGROUND)
+        self.assertFalse(sync_mock.call_args.args[0]['write_calendar'])
+        self.assertEqual(list(feeds.load_assignments(7)), [self.assignment(1).url])
@@ -5,4 +5,7 @@ from . import views
 
 urlpatterns = [
     path('sync/', views.calendar_sync, name='sync'),
+    path('sync/events/', views.sync_events, name='sync_events'),
+    path('feed/', views.feed_url, name='feed_url'),
+    path('feed/<str:token>.ics', views.feed, name='feed'),
 ]
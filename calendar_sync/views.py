@@ -1,31 +1,178 @@
 """Views for the calendar_sync app."""
 from __future__ import annotations
 
+import functools
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
+from typing import TYPE_CHECKING, Any
 
+from asgiref.sync import sync_to_async
 from background_task import background
-from django.http import HttpResponse
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils import timezone
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition, require_safe
 
 from oauth.models import UserOAuth
 
-from . import sync
+from . import coalescing, feeds, jobs, progress, runs, scheduling, sync
+from .models import SyncRun
+from .sync import circuit
+from .sync.exceptions import CircuitOpenException
+from .sync.records import SyncTargets
+from .sync.utils import get_assign_id
 
+if TYPE_CHECKING:
+    from collections.abc import Hashable
 
-def trigger_sync(user_id: int, session_id: str):
-    """Trigger sync for the given user."""
-    config = sync.config.load_config()
-    config['login_with_token'] = True
-    config['moodle_session_id'] = session_id
+logger = logging.getLogger(__name__)
 
-    user_token_path = UserOAuth.objects.get(user_id=user_id).oauth_credentials.path
-    config['google_token_path'] = user_token_path
-    sync.main.sync(config)
+# maximum number of users synced by one run of `background_sync`
+BACKGROUND_BATCH_SIZE = 50
+
+# syncs wait on Moodle and Google for seconds, a bounded pool of their own keeps them from
+# taking every thread of the default executor shared by the other async views
+sync_executor = ThreadPoolExecutor(max_workers=settings.CALENDAR_SYNC_THREADS,
+                                   thread_name_prefix='calendar_sync')
+
+
+def trigger_sync(user_id: int, session_id: str, trigger: str = SyncRun.MANUAL,
+                 profile: bool = False, targets: SyncTargets | None = None) -> dict[str, Any]:
+    """
+    Trigger sync for the given user and reschedule their next background sync.
+    Concurrent triggers for the same user share one sync, see `calendar_sync.coalescing`.
+    If `profile` is set, the sync is profiled unless it joins one in flight.
+    If `targets` are given, only those are synced and stored, without rescheduling. Such
+    syncs are not debounced and only share a sync with the same targets.
+    """
+    run = functools.partial(leased_sync, user_id, session_id, trigger, profile, targets)
+    return coalescing.coalesce(sync_key(user_id, targets), run, debounce=targets is None)
+
+
+def sync_key(user_id: int, targets: SyncTargets | None) -> Hashable:
+    """Key the syncs of the user with the targets are coalesced and publish progress by."""
+    return user_id if targets is None else (user_id, targets)
+
+
+def leased_sync(user_id: int, session_id: str, trigger: str, profile: bool = False,
+                targets: SyncTargets | None = None) -> dict[str, Any]:
+    """
+    Sync the user holding the lease on their job, so that it never overlaps a sync in
+    another process. If another process is syncing the user, or has just done so, its
+    stored result is returned instead, except for targeted syncs which wait for their turn
+    and raise `TimeoutError` if it doesn't come, see `jobs.wait_and_claim_user`.
+    """
+    worker_id = jobs.make_worker_id()
+    if targets is not None:
+        schedule = jobs.wait_and_claim_user(user_id, worker_id)
+    else:
+        schedule = jobs.claim_user(user_id, worker_id)
+    if schedule is None:
+        jobs.wait_for_release(user_id)
+        return stored_result(user_id)
+    try:
+        if (targets is None and schedule.last_synced_at is not None
+                and schedule.last_synced_at > timezone.now() - coalescing.DEBOUNCE_WINDOW):
+            return stored_result(user_id)
+        with jobs.Heartbeat(schedule, worker_id):
+            return sync_user(user_id, session_id, trigger, profile, targets)
+    finally:
+        jobs.release(schedule, worker_id)
+
+
+def sync_user(user_id: int, session_id: str, trigger: str, profile: bool = False,
+              targets: SyncTargets | None = None) -> dict[str, Any]:
+    """
+    Sync the given user, or only the given targets, and store the result, profiling the
+    sync if `profile` is set. Users who haven't bound a Google account are only crawled,
+    for their feed.
+    """
+    with runs.track_run(user_id, trigger) as metrics:
+        config = sync.config.load_config(settings.CALENDAR_SYNC_CONFIG)
+        config['login_with_token'] = True
+        config['moodle_session_id'] = session_id
+        config['profile'] = config['profile'] or profile
+        if targets is not None:
+            config['course_ids'] = targets.course_ids
+            config['assign_urls'] = targets.assign_urls
+
+        oauth = UserOAuth.objects.filter(user_id=user_id).first()
+        if oauth is None:
+            # users subscribed to their feed without binding a Google account
+            config['write_calendar'] = False
+        else:
+            config['google_token_path'] = oauth.oauth_credentials.path
+        result = sync.main.sync(config, metrics=metrics,
+                                known_assignments=feeds.load_assignments(user_id),
+                                progress=functools.partial(progress.publish,
+                                                           sync_key(user_id, targets)))
+    if targets is None:
+        scheduling.record_sync(user_id, result)
+        feeds.store_assignments(user_id, result['assignments'])
+    else:
+        # the other assignments were not crawled, and the schedule needs a full sync
+        feeds.store_assignments(user_id, result['assignments'], prune=False)
+    return result
+
+
+def stored_result(user_id: int) -> dict[str, Any]:
+    """Result of the user's latest sync as stored by another process, with no changes."""
+    return {
+        'assignments': list(feeds.load_assignments(user_id).values()),
+        'created': 0,
+        'updated': 0,
+        'metrics': None,
+    }
+
+
+def trigger_sync_in_thread(user_id: int, session_id: str, profile: bool,
+                           targets: SyncTargets | None) -> dict[str, Any]:
+    """Run `trigger_sync` in a worker thread of an async view, closing its connections after."""
+    try:
+        return trigger_sync(user_id, session_id, profile=profile, targets=targets)
+    finally:
+        connections.close_all()
+
+
+def parse_targets(request) -> SyncTargets | None:
+    """
+    Parse the optional JSON body of a sync request limiting it to some courses and
+    assignments, e.g. `{"course_ids": [123], "assignment_urls": [".../view.php?id=456"]}`.
+    Raises `ValueError` if the body is invalid.
+    """
+    if request.content_type != 'application/json' or not request.body:
+        return None
+    data = json.loads(request.body)
+    if not isinstance(data, dict):
+        raise ValueError('Expected a JSON object.')
+    course_ids = data.get('course_ids', [])
+    assign_urls = data.get('assignment_urls', [])
+    if not isinstance(course_ids, list) or not isinstance(assign_urls, list):
+        raise ValueError('Expected lists of course IDs and assignment URLs.')
+    # bool is a subclass of int, but `true` is not a course ID
+    if not all(isinstance(course_id, int) and not isinstance(course_id, bool)
+               for course_id in course_ids):
+        raise ValueError('Course IDs must be integers.')
+    if not all(isinstance(url, str) for url in assign_urls):
+        raise ValueError('Assignment URLs must be strings.')
+    for url in assign_urls:
+        get_assign_id(url)
+    if not course_ids and not assign_urls:
+        return None
+    return SyncTargets(course_ids=tuple(course_ids), assign_urls=tuple(assign_urls))
 
 
 @csrf_exempt
-def calendar_sync(request):
-    """Fetch user's Moodle calendar and sync with Google Calendar."""
+async def calendar_sync(request):
+    """
+    Fetch user's Moodle calendar and sync with Google Calendar, or only the courses and
+    assignments given in the body, see `parse_targets`.
+    """
     if request.method == 'POST':
         # return 400 if Moodle-Session header is not present
         if 'Moodle-Session' not in request.headers.keys():
@@ -35,15 +182,153 @@ def calendar_sync(request):
 
         session_id = request.headers['Moodle-Session']
         user_id = int(request.headers['Moodle-ID'])
-        trigger_sync(user_id, session_id)
+        profile = (settings.CALENDAR_SYNC_PROFILE_HEADER
+                   and request.headers.get('Sync-Profile') == '1')
+        try:
+            targets = parse_targets(request)
+        except ValueError:
+            return HttpResponse(status=400)
+        await sync_to_async(scheduling.record_activity)(user_id, session_id)
+        try:
+            # the sync waits on Moodle and Google for seconds, so it runs in a worker thread
+            # instead of holding the thread shared by the ORM calls of all async views
+            await sync_to_async(trigger_sync_in_thread, thread_sensitive=False,
+                                executor=sync_executor)(user_id, session_id, profile, targets)
+        except CircuitOpenException as e:
+            response = HttpResponse(status=503)
+            response['Retry-After'] = str(max(1, round(e.retry_after)))
+            return response
 
         return HttpResponse(status=200)
     else:
         return HttpResponse(status=405)
 
 
+@csrf_exempt
+async def sync_events(request):
+    """
+    Sync like `calendar_sync`, streaming the progress of the sync as server-sent events
+    while it runs. Joins the user's sync if one is already running in this process.
+    """
+    if request.method != 'POST':
+        return HttpResponse(status=405)
+    if 'Moodle-Session' not in request.headers.keys():
+        return HttpResponse(status=400)
+    if 'Moodle-ID' not in request.headers.keys():
+        return HttpResponse(status=400)
+
+    session_id = request.headers['Moodle-Session']
+    user_id = int(request.headers['Moodle-ID'])
+    try:
+        targets = parse_targets(request)
+    except ValueError:
+        return HttpResponse(status=400)
+    await sync_to_async(scheduling.record_activity)(user_id, session_id)
+    # the stream starts the sync, on the event loop that consumes it
+    run_sync = functools.partial(
+        sync_to_async(trigger_sync_in_thread, thread_sensitive=False, executor=sync_executor),
+        user_id, session_id, False, targets)
+    response = StreamingHttpResponse(
+        progress.stream(sync_key(user_id, targets), run_sync), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # keep nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def session_user_id(session_id: str) -> str | None:
+    """Ask Moodle for the ID of the user logged in with the session, None if nobody is."""
+    config = sync.config.load_config(settings.CALENDAR_SYNC_CONFIG)
+    crawler = sync.crawler.MoodleCrawler(session_id=session_id, moodle_url=config['moodle_url'])
+    try:
+        return crawler.get_user_id()
+    except sync.exceptions.ElementNotFoundException:
+        return None
+
+
+def feed_url(request):
+    """
+    Get the URL of the user's iCalendar feed. The URL gives access to the feed, so it is
+    only issued to the user logged in to Moodle with the given session. The session is
+    kept for the background syncs, which only crawl Moodle for users without Google.
+    """
+    if 'Moodle-Session' not in request.headers.keys():
+        return HttpResponse(status=400)
+    if 'Moodle-ID' not in request.headers.keys():
+        return HttpResponse(status=400)
+
+    session_id = request.headers['Moodle-Session']
+    moodle_id = int(request.headers['Moodle-ID'])
+    try:
+        if session_user_id(session_id) != str(moodle_id):
+            return HttpResponse(status=403)
+    except CircuitOpenException as e:
+        response = HttpResponse(status=503)
+        response['Retry-After'] = str(max(1, round(e.retry_after)))
+        return response
+
+    scheduling.record_activity(moodle_id, session_id)
+    url = reverse('feed', args=[feeds.make_feed_token(moodle_id)])
+    return HttpResponse(request.build_absolute_uri(url))
+
+
+def feed_etag(request, token: str) -> str | None:
+    """Get the ETag of the feed, so that unchanged feeds are answered with 304."""
+    user_id = feeds.get_user_id(token)
+    return feeds.get_feed_etag(user_id) if user_id is not None else None
+
+
+@require_safe
+@condition(etag_func=feed_etag)
+def feed(request, token: str):
+    """Serve the user's deadlines as an iCalendar feed."""
+    user_id = feeds.get_user_id(token)
+    if user_id is None:
+        return HttpResponse(status=404)
+    return HttpResponse(feeds.render_feed(user_id), content_type='text/calendar; charset=utf-8')
+
+
+def trigger_background_sync(user_id: int, session_id: str) -> dict[str, Any]:
+    """
+    Trigger sync for the given user on behalf of the scheduler, which holds the lease.
+    Not debounced, since a due user has to be rescheduled by a sync of their own.
+    """
+    return coalescing.coalesce(user_id, functools.partial(
+        sync_user, user_id, session_id, SyncRun.BACKGROUND), debounce=False)
+
+
+def sync_account() -> None:
+    """
+    Sync the account configured in `settings.CALENDAR_SYNC_ACCOUNT_CONFIG`, which logs in
+    with its own Moodle credentials instead of a user's session.
+    """
+    if settings.CALENDAR_SYNC_ACCOUNT_CONFIG is None:
+        return
+    try:
+        sync.main.sync(sync.config.load_config(settings.CALENDAR_SYNC_ACCOUNT_CONFIG))
+    except CircuitOpenException as e:
+        logger.info('Skipping sync of the configured account: %s', e)
+    except Exception:  # pylint: disable=broad-except
+        logger.exception('Sync of the configured account failed.')
+
+
 @background(schedule=timedelta(minutes=5))
 def background_sync():
-    """Background task to sync all users' Moodle calendars with Google Calendar."""
-    config = sync.config.load_config('sync_config.yaml')
-    sync.main.sync(config)
+    """
+    Background task to sync the configured account, see `sync_account`, and up to
+    `BACKGROUND_BATCH_SIZE` users whose next sync is due with Google Calendar. Should be
+    repeated every `scheduling.MIN_SYNC_INTERVAL`. Claims jobs like the `run_sync_worker`
+    command does, so both can run at the same time.
+    """
+    sync_account()
+
+    worker_id = jobs.make_worker_id()
+    for _ in range(BACKGROUND_BATCH_SIZE):
+        if circuit.retry_after() > 0:
+            # leave the due users for when Moodle or Google is back
+            return
+        # claim one job at a time, since only the running job's lease is kept alive
+        claimed = jobs.claim(worker_id, limit=1)
+        if not claimed:
+            return
+        jobs.run_job(claimed[0], worker_id, trigger_background_sync)
@@ -166,6 +166,17 @@ LOGGING = {
 
 }
 
+# Calendar sync
+# YAML file merged into the default config of every sync, None to use the defaults
+CALENDAR_SYNC_CONFIG = None
+# YAML config of an account synced by every run of `background_sync` with the Moodle
+# credentials in its config, None to sync only the users who signed up
+CALENDAR_SYNC_ACCOUNT_CONFIG = 'sync_config.yaml'
+# threads running the syncs of requests, which queue when all are busy
+CALENDAR_SYNC_THREADS = 16
+# whether a `Sync-Profile: 1` header on a sync request profiles that sync
+CALENDAR_SYNC_PROFILE_HEADER = False
+
 # CORS
 CORS_ALLOW_ALL_ORIGINS = True
 CORS_ALLOW_HEADERS = [
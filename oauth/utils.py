@@ -1,9 +1,6 @@
 """Utilities for the oauth app."""
 import logging
 
-from googleapiclient import errors
-from googleapiclient.discovery import build
-
 logger = logging.getLogger(__name__)
 
 
@@ -16,6 +13,11 @@ def get_user_info(credentials):
     Returns:
       User information as a dict.
     """
+    # imported here to keep it out of the startup of every worker
+    # pylint: disable=import-outside-toplevel
+    from googleapiclient import errors
+    from googleapiclient.discovery import build
+
     user_info_service = build(
         serviceName='oauth2', version='v2',
         credentials=credentials)
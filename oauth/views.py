@@ -1,12 +1,12 @@
 """Views for the oauth app."""
 import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
 
-import jwt
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.core.files.base import ContentFile
 from django.http import HttpResponse
-from google_auth_oauthlib.flow import Flow
 
 from oauth.utils import get_user_info
 
@@ -17,6 +17,10 @@ logger = logging.getLogger(__name__)
 JWT_SECRET = os.environ.get("JWT_SECRET_KEY")
 API_CRED_PATH = os.path.join(settings.BASE_DIR, "secrets", "api_credentials.json")
 
+# the calls to Google of the OAuth flow get threads of their own, so that a burst of syncs
+# can't hold up users binding their accounts
+oauth_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='oauth')
+
 
 def status(request):
     """Check if the user has authorized the app."""
@@ -32,39 +36,65 @@ def status(request):
     return HttpResponse(user.email, status=200)
 
 
-def bind(request):
-    """Binds user's google account to their Moodle ID."""
-
-    # return 400 if Moodle-ID header is not present
-    if 'Moodle-ID' not in request.headers.keys():
-        return HttpResponse(status=400)
-
-    moodle_id = request.headers['Moodle-ID']
-    enc_jwt = jwt.encode({"MoodleID": moodle_id}, key=JWT_SECRET, algorithm='HS256')
+def make_flow(state: str):
+    """Create the Google OAuth flow carrying `state`."""
+    # imported here to keep it out of the startup of every worker
+    # pylint: disable=import-outside-toplevel
+    from google_auth_oauthlib.flow import Flow
 
-    # create google oauth flow
-    flow = Flow.from_client_secrets_file(
+    return Flow.from_client_secrets_file(
         API_CRED_PATH,
         scopes=[
             'openid',
             'https://www.googleapis.com/auth/userinfo.email',
             'https://www.googleapis.com/auth/calendar',
         ],
-        state=enc_jwt,
+        state=state,
         redirect_uri="https://simonliu423.dev/mc/api/oauth/callback"
     )
 
-    # redirect user to google oauth flow
+
+def get_authorization_url(state: str) -> str:
+    """Get the URL of the Google OAuth consent screen."""
+    flow = make_flow(state)
     authorize_url, _ = flow.authorization_url(
         access_type='offline',
         prompt='consent',
         include_granted_scopes='true'
     )
+    return authorize_url
+
+
+def fetch_credentials(state: str, code: str):
+    """Exchange the authorization code for the user's credentials."""
+    flow = make_flow(state)
+    flow.fetch_token(code=code)
+    return flow.credentials
+
+
+async def bind(request):
+    """Binds user's google account to their Moodle ID."""
+
+    # return 400 if Moodle-ID header is not present
+    if 'Moodle-ID' not in request.headers.keys():
+        return HttpResponse(status=400)
+
+    # imported here to keep it out of the startup of every worker
+    import jwt  # pylint: disable=import-outside-toplevel
+
+    moodle_id = request.headers['Moodle-ID']
+    enc_jwt = jwt.encode({"MoodleID": moodle_id}, key=JWT_SECRET, algorithm='HS256')
+
+    # redirect user to google oauth flow, reading the client secrets in a worker thread
+    authorize_url = await sync_to_async(
+        get_authorization_url, thread_sensitive=False, executor=oauth_executor)(enc_jwt)
     return HttpResponse(authorize_url)
 
 
-def callback(request):
+async def callback(request):
     """Callback for the google oauth flow."""
+    # imported here to keep it out of the startup of every worker
+    import jwt  # pylint: disable=import-outside-toplevel
 
     state = request.GET.get('state')
 
@@ -73,35 +103,26 @@ def callback(request):
         enc_jwt = jwt.decode(state, JWT_SECRET, algorithms=['HS256'])
     except jwt.exceptions.InvalidSignatureError:
         return HttpResponse(status=400)
-    user_id = enc_jwt['MoodleID']
+    user_id = int(enc_jwt['MoodleID'])
 
-    # retrieve user's oauth credentials
-    flow = Flow.from_client_secrets_file(
-        API_CRED_PATH,
-        scopes=[
-            'openid',
-            'https://www.googleapis.com/auth/userinfo.email',
-            'https://www.googleapis.com/auth/calendar',
-        ],
-        state=request.GET.get('state'),
-        redirect_uri="https://simonliu423.dev/mc/api/oauth/callback"
-    )
+    # the token exchange and the UserInfo request block for their full latency, so they run
+    # in worker threads and don't hold up the other requests of the event loop
     code = request.GET.get('code')
-    flow.fetch_token(code=code)
-    credentials = flow.credentials
-
-    user_info = get_user_info(credentials)
+    credentials = await sync_to_async(
+        fetch_credentials, thread_sensitive=False, executor=oauth_executor)(state, code)
+    user_info = await sync_to_async(
+        get_user_info, thread_sensitive=False, executor=oauth_executor)(credentials)
 
     logger.info('Authorized user %s', user_info)
 
     # store oauth credentials in file and database
     file_content = ContentFile(credentials.to_json())
-    if UserOAuth.objects.filter(user_id=int(user_id)).exists():
-        obj = UserOAuth.objects.get(user_id=int(user_id))
-        obj.oauth_credentials.delete()
+    obj = await UserOAuth.objects.filter(user_id=user_id).afirst()
+    if obj is not None:
+        await sync_to_async(obj.oauth_credentials.delete)()
     else:
-        obj = UserOAuth(user_id=int(user_id))
+        obj = UserOAuth(user_id=user_id)
     obj.email = user_info['email']
-    obj.oauth_credentials.save(f'user_{user_id}.json', file_content)
-    obj.save()
+    await sync_to_async(obj.oauth_credentials.save)(f'user_{user_id}.json', file_content)
+    await obj.asave()
     return HttpResponse('成功綁定帳號，請關閉此視窗')